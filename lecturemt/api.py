@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""api.py: REST API of LectureMT, as a WSGI application that forwards the requests to the LectureMT server."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+from bottle import Bottle, request, response
+import datetime
+import json
+from lecturemt.client import Client, ClientPool
+from lecturemt.cluster import Placement, get_servers
+import sys
+
+
+def make_app(config, persistent=False, pool_size=2):
+    """
+    Return the WSGI application.  The user is taken from REMOTE_USER, set by the web server after authentication.
+
+    When persistent is True, a few multiplexed connections to the LectureMT server are kept open and
+    shared by all the requests.  This is meant for long-running deployments (mod_wsgi, etc.).  In CGI mode, where a process
+    serves a single request, a new connection is opened for each request instead.
+
+    When the [Cluster] section lists several instances of the server, the requests of a user go to the
+    instance the user is placed on and the lookups of a translation go to the instance keeping it.
+    The requests about the servers themselves and the listing of all the translations (by admin)
+    are sent to all the instances.
+    """
+    app = Bottle()
+
+    servers = get_servers(config)
+    if not servers:
+        servers[''] = (config['Server']['Host'], int(config['Server']['Port']))
+    first_instance = next(iter(servers))
+    placement = Placement(list(servers.keys())) if len(servers) > 1 else None
+    if persistent:
+        pools = {instance_id: ClientPool(host, port, size=pool_size) for (instance_id, (host, port)) in servers.items()}
+        get_client = lambda instance_id: pools[instance_id]
+    else:
+        get_client = lambda instance_id: Client(*servers[instance_id])
+
+    def submit(req_data, instance_id=None):
+        # The request is serialized here rather than built from a string template
+        # so that any text (quotes, backslashes, newlines, etc.) is properly escaped.
+        req = json.dumps(req_data, ensure_ascii=False)
+        resp = {}
+        try:
+            resp = get_client(instance_id if instance_id is not None else first_instance).submit(req)
+            response.content_type = 'application/json'
+        except:
+            resp = str(sys.exc_info()[0])
+        return resp
+
+    def submit_parsed(req_data, instance_id):
+        """Return (response, None) with the parsed response of the instance, or (None, error) if the request failed."""
+        resp = submit(req_data, instance_id)
+        try:
+            parsed = json.loads(resp)
+        except ValueError:
+            return (None, resp)
+        if not isinstance(parsed, dict):
+            return (None, resp)
+        if 'error' in parsed:
+            return (None, parsed['error'])
+        return (parsed, None)
+
+    def submit_to_all(req_data):
+        """
+        Return the responses of all the instances, by instance id.  An instance that is down or fails
+        does not fail the others: its response is {"error": reason}.
+        """
+        if placement is None:
+            return submit(req_data)
+        responses = {}
+        for instance_id in servers:
+            (resp, error) = submit_parsed(req_data, instance_id)
+            responses[instance_id] = resp if error is None else {'error': error}
+        response.content_type = 'application/json'
+        return json.dumps(responses, ensure_ascii=False)
+
+    def user_id():
+        return request.environ['REMOTE_USER']
+
+    def user_instance():
+        return placement.get_instance_of_user(user_id()) if placement is not None else None
+
+    def translation_instance(id):
+        return placement.get_instance_of_translation(id) if placement is not None else None
+
+    def is_sentence_list(sentences):
+        return isinstance(sentences, list) and len(sentences) > 0 and all(isinstance(sentence, str) and sentence.strip() != '' for sentence in sentences)
+
+    def get_all_translations_page(req_data):
+        # The cursor of a page of all the translations is made of the id of an instance and of the cursor within it.
+        # The instances that cannot be reached are skipped and listed in errors.
+        instance_ids = list(servers.keys())
+        if req_data['cursor'] != '' and not '|' in req_data['cursor']:
+            response.status = 400
+            return 'Invalid request.'
+        (instance_id, cursor) = req_data['cursor'].split('|', 1) if req_data['cursor'] != '' else (first_instance, '')
+        if not instance_id in servers:
+            response.status = 400
+            return 'Invalid request.'
+        translations = {}
+        errors = {}
+        def make_page(next_cursor):
+            page = {'translations': translations, 'next_cursor': next_cursor}
+            if errors:
+                page['errors'] = errors
+            response.content_type = 'application/json'
+            return json.dumps(page, ensure_ascii=False)
+        for index in range(instance_ids.index(instance_id), len(instance_ids)):
+            (page, error) = submit_parsed(dict(req_data, cursor=cursor, limit=req_data['limit'] - len(translations)), instance_ids[index])
+            cursor = ''
+            if error is not None:
+                errors[instance_ids[index]] = error
+                continue
+            if not 'translations' in page:
+                # The instance found the request invalid, because of the cursor.
+                response.status = 400
+                return 'Invalid request.'
+            translations.update(page['translations'])
+            if page['next_cursor'] is not None:
+                return make_page("{0}|{1}".format(instance_ids[index], page['next_cursor']))
+            if len(translations) >= req_data['limit'] and index + 1 < len(instance_ids):
+                return make_page("{0}|".format(instance_ids[index + 1]))
+        return make_page(None)
+
+    @app.get('/api_version')
+    def get_api_version():
+        return '1.0'
+
+    @app.get('/server_version')
+    def get_server_version():
+        return submit({"action": "get_server_version"})
+
+    @app.get('/server_status')
+    def get_server_status():
+        return submit_to_all({"action": "get_server_status"})
+
+    @app.get('/server_metrics')
+    def get_server_metrics():
+        return submit_to_all({"action": "get_server_metrics"})
+
+    @app.get('/translation_queues')
+    def get_translation_queues():
+        return {}
+
+    @app.get('/translation_queue/<id>')
+    def get_translation_queue(id):
+        return {}
+
+    @app.get('/translations')
+    def get_translations():
+        req_data = {"action": "get_translations", "user_id": user_id()}
+        if 'limit' in request.query:
+            req_data["cursor"] = request.query.get('cursor', '')
+            try:
+                req_data["limit"] = int(request.query['limit'])
+            except ValueError:
+                req_data["limit"] = 0
+            if req_data["limit"] < 1:
+                response.status = 400
+                return 'Invalid request.'
+        if placement is not None and user_id() == "admin":
+            if 'limit' in req_data:
+                return get_all_translations_page(req_data)
+            # The translations of the instances that cannot be reached are missing; these instances are
+            # listed in the X-LectureMT-Failed-Instances header.
+            translations = {}
+            failed_instances = []
+            for instance_id in servers:
+                (resp, error) = submit_parsed(req_data, instance_id)
+                if error is not None:
+                    failed_instances.append(instance_id)
+                    continue
+                translations.update(resp)
+            if failed_instances:
+                response.set_header('X-LectureMT-Failed-Instances', ",".join(failed_instances))
+            response.content_type = 'application/json'
+            return json.dumps(translations, ensure_ascii=False)
+        return submit(req_data, user_instance())
+
+    @app.post('/translation')
+    def add_translation():
+        str_content = request.body.read().decode('utf-8')
+        json_content = json.loads(str_content)
+
+        if not "lang_source" in json_content or not "lang_target" in json_content or not "text_source" in json_content or json_content["text_source"].strip() == '' or \
+            not all(isinstance(json_content.get(key, ''), str) for key in ("priority", "segment_key")):
+            response.status = 400
+            return 'Invalid request.'
+
+        req_data = { "action": "add_translation", "user_id": user_id(),
+                     "lang_source": json_content['lang_source'], "lang_target": json_content['lang_target'],
+                     "text_source": json_content['text_source'],
+                     "date_submission": str(datetime.datetime.now()) }
+        if "priority" in json_content:
+            req_data["priority"] = json_content["priority"]
+        if "segment_key" in json_content:
+            req_data["segment_key"] = json_content["segment_key"]
+        resp = submit(req_data, user_instance())
+
+        if resp == "{}":
+            response.status = 400
+            return 'Invalid request.'
+        if resp.startswith('{"error":'):
+            response.status = 500
+            return resp
+
+        response.status = 201
+        return resp
+
+    @app.post('/document')
+    def add_document():
+        str_content = request.body.read().decode('utf-8')
+        json_content = json.loads(str_content)
+
+        if not "lang_source" in json_content or not "lang_target" in json_content or \
+            not ("text_source" in json_content and json_content["text_source"].strip() != '' or "sentences" in json_content) or \
+            not isinstance(json_content.get("priority", ''), str) or \
+            "sentences" in json_content and not is_sentence_list(json_content["sentences"]):
+            response.status = 400
+            return 'Invalid request.'
+
+        req_data = { "action": "add_document", "user_id": user_id(),
+                     "lang_source": json_content['lang_source'], "lang_target": json_content['lang_target'],
+                     "date_submission": str(datetime.datetime.now()) }
+        if "sentences" in json_content:
+            req_data["sentences"] = json_content["sentences"]
+        else:
+            req_data["text_source"] = json_content["text_source"]
+        if "priority" in json_content:
+            req_data["priority"] = json_content["priority"]
+        resp = submit(req_data, user_instance())
+
+        if resp == "{}":
+            response.status = 400
+            return 'Invalid request.'
+        if resp.startswith('{"error":'):
+            response.status = 500
+            return resp
+
+        response.status = 201
+        return resp
+
+    @app.get('/translations/events')
+    def get_translation_events():
+        # Server-Sent Events: each translation is pushed as soon as it is processed.
+        # The last event, named "end", lists the translations still pending when the timeout hit.
+        req = json.dumps({"action": "watch_translations", "user_id": user_id(), "timeout": float(request.query.get('timeout', 30))})
+        client = get_client(user_instance() if placement is not None else first_instance)
+        response.content_type = 'text/event-stream'
+        response.set_header('Cache-Control', 'no-cache')
+        def generate_events():
+            try:
+                for resp in client.submit_stream(req):
+                    event = "end" if resp.startswith('{"pending":') else "translation"
+                    yield "event: {0}\ndata: {1}\n\n".format(event, resp)
+            except:
+                yield "event: error\ndata: {0}\n\n".format(str(sys.exc_info()[0]))
+        return generate_events()
+
+    @app.get('/translation/<id>')
+    def get_translation(id):
+        if 'wait' in request.query:
+            try:
+                timeout = float(request.query['wait'])
+            except ValueError:
+                response.status = 400
+                return 'Invalid request.'
+            return submit({"action": "wait_translation", "user_id": user_id(), "translation_id": id, "timeout": timeout}, translation_instance(id))
+        return submit({"action": "get_translation", "user_id": user_id(), "translation_id": id}, translation_instance(id))
+
+    @app.delete('/translation/<id>')
+    def delete_translation(id):
+        return submit({"action": "remove_translation", "user_id": user_id(), "translation_id": id}, translation_instance(id))
+
+    return app
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""benchmark.py: End-to-end benchmark of LectureMT running on a single machine with stand-ins for the broker, segmenter and translation servers."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import argparse
+import configparser
+import http.server
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+import timeit
+import wsgiref.simple_server
+
+# The modules of the server import each other by their plain names, so their directory is needed
+# on the path when the benchmark is run with python -m lecturemt.benchmark.  The parent directory
+# is needed for the REST API (lecturemt.api).
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client import Client
+from metrics import ThreadingHTTPServer
+
+LANG_PAIR = "ja-en"
+
+
+def make_sampler(spec):
+    """
+    Return a function that draws a latency in seconds from the distribution described by spec:
+    const:VALUE, uniform:LOW,HIGH, normal:MEAN,STDDEV, lognormal:MEDIAN,SIGMA or exp:MEAN.
+    """
+    (name, _, params) = spec.partition(':')
+    values = [float(value) for value in params.split(',')] if params else []
+    if name == 'const':
+        return lambda: values[0]
+    if name == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if name == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if name == 'lognormal':
+        return lambda: values[0] * random.lognormvariate(0, values[1])
+    if name == 'exp':
+        return lambda: random.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError("Unknown latency distribution: {0}".format(spec))
+
+
+def sleep_sample(sampler):
+    latency = sampler()
+    if latency > 0:
+        time.sleep(latency)
+
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    def at(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {'count': len(samples), 'mean': sum(samples) / len(samples), 'p50': at(0.5), 'p95': at(0.95), 'p99': at(0.99), 'max': samples[-1]}
+
+
+class FakeSegmenterServer(threading.Thread):
+
+    # Speaks the line protocol of SocketSegmenter in persistent mode: one line in, one line out.
+    # Each line is delayed by a latency drawn from the sampler.
+    def __init__(self, sampler):
+        threading.Thread.__init__(self)
+        self.name = "FakeSegmenterServer"
+        self.daemon = True
+
+        class SegmenterRequestHandler(socketserver.StreamRequestHandler):
+
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                for line in self.rfile:
+                    sleep_sample(sampler)
+                    self.wfile.write(line)
+                    self.wfile.flush()
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SegmenterRequestHandler)
+        self.server.daemon_threads = True
+        self.server_address = self.server.server_address
+
+    def run(self):
+        self.server.serve_forever()
+
+
+class FakeOpenNMTServer(threading.Thread):
+
+    # Speaks the REST API of the OpenNMT server used by OpenNMTClient.  A batch takes
+    # a latency drawn from batch_sampler plus one drawn from sentence_sampler per sentence.
+    def __init__(self, batch_sampler, sentence_sampler):
+        threading.Thread.__init__(self)
+        self.name = "FakeOpenNMTServer"
+        self.daemon = True
+
+        class OpenNMTRequestHandler(http.server.BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def send_json(self, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.send_json({'models': [{'model_id': 0}]})
+
+            def do_POST(self):
+                requests = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                latency = batch_sampler() + sum(sentence_sampler() for request in requests)
+                if latency > 0:
+                    time.sleep(latency)
+                self.send_json([[{'src': request['src'], 'tgt': "[en] {0}".format(request['src'])} for request in requests]])
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), OpenNMTRequestHandler)
+        self.server_address = self.server.server_address
+
+    def run(self):
+        self.server.serve_forever()
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
+
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(wsgiref.simple_server.WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Deployment(object):
+
+    # The LectureMT server, its translation workers and the REST API, all in this process.
+    # With the local broker, the messages go through the local transport instead of RabbitMQ.
+    def __init__(self, args):
+        self.server_module = importlib.import_module('server')
+        self.translator_module = importlib.import_module('translator')
+        self.server_module.log = logging.getLogger("default")
+        self.translator_module.log = logging.getLogger("default")
+
+        config = configparser.ConfigParser()
+        if args.broker == 'rabbitmq':
+            config.read(args.config)
+        else:
+            config.read_dict({'Transport': {'Type': 'Local'}})
+        config.read_dict({'Server': {'Host': '127.0.0.1', 'Port': '0', 'LanguagePairs': LANG_PAIR, 'Engine': args.engine, 'MaxWait': str(args.timeout)},
+            'Expiration': {'DefaultTTL': '3600'}})
+        self.config = config
+
+        self.segmenter_server = FakeSegmenterServer(make_sampler(args.segmenter_latency))
+        self.segmenter_server.start()
+        self.nmt_server = FakeOpenNMTServer(make_sampler(args.batch_latency), make_sampler(args.sentence_latency))
+        self.nmt_server.start()
+
+        server_address = ('127.0.0.1', 0)
+        if args.engine == 'asyncio':
+            self.server = self.server_module.AsyncServer(server_address, config)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            while self.server.server is None:
+                time.sleep(0.01)
+        else:
+            self.server = self.server_module.Server(server_address, config)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.server_address = self.server.server_address
+        self.manager = self.server.manager
+
+        self.workers = []
+        for i in range(0, args.workers):
+            worker = self.translator_module.Worker("Benchmark_{0}_{1}".format(LANG_PAIR, i + 1), LANG_PAIR, self.manager.transport,
+                'OpenNMT', self.nmt_server.server_address[0], self.nmt_server.server_address[1],
+                self.segmenter_server.server_address[0], self.segmenter_server.server_address[1], '',
+                max_batch_size=args.batch_size, max_batch_wait=args.batch_wait, segmenter_type='Socket')
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        self.http_server = None
+        if 'http' in args.clients:
+            api = importlib.import_module('lecturemt.api')
+            api_config = configparser.ConfigParser()
+            api_config.read_dict({'Server': {'Host': self.server_address[0], 'Port': str(self.server_address[1])}})
+            app = api.make_app(api_config, persistent=True)
+            def authenticated_app(environ, start_response):
+                environ['REMOTE_USER'] = 'benchmark'
+                # The endpoint ends with a slash, so the paths start with two.  A web server in front of the
+                # API would merge them, but wsgiref only does so from Python 3.11.
+                environ['PATH_INFO'] = '/' + environ['PATH_INFO'].lstrip('/')
+                return app(environ, start_response)
+            self.http_server = wsgiref.simple_server.make_server('127.0.0.1', 0, authenticated_app,
+                server_class=ThreadingWSGIServer, handler_class=QuietWSGIRequestHandler)
+            threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    def reset_metrics(self):
+        self.manager.metrics.reset()
+        for worker in self.workers:
+            worker.metrics.reset()
+
+    def get_metrics(self):
+        return {'server': self.manager.metrics.to_dict(),
+            'translators': {worker.name: worker.metrics.to_dict() for worker in self.workers}}
+
+
+class SocketLoadClient(object):
+
+    # One persistent framed connection per thread, as a long-running caller of client.Client would do.
+    def __init__(self, deployment, timeout):
+        self.address = deployment.server_address
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client(self.address[0], self.address[1], persistent=True, timeout=self.timeout + 10)
+        return self.local.client
+
+    def submit(self, text, user_id="benchmark", priority="live"):
+        response = json.loads(self._client().submit(json.dumps({"action": "add_translation", "user_id": user_id,
+            "lang_source": "ja", "lang_target": "en", "text_source": text, "date_submission": str(time.time()), "priority": priority})))
+        return response['id']
+
+    def wait(self, translation_id, user_id="benchmark"):
+        return json.loads(self._client().submit(json.dumps({"action": "wait_translation", "user_id": user_id,
+            "translation_id": translation_id, "timeout": self.timeout})))
+
+    def close(self):
+        pass
+
+
+class HttpLoadClient(object):
+
+    # A single LectureMT_Http_Client shared by all the threads, going through the REST API.
+    def __init__(self, deployment, timeout, concurrency):
+        httpclient = importlib.import_module('lecturemt.httpclient')
+        endpoint = "127.0.0.1:{0}/".format(deployment.http_server.server_address[1])
+        self.client = httpclient.LectureMT_Http_Client(endpoint, 'benchmark', 'benchmark', pool_size=concurrency, timeout=10, use_ssl=False)
+        self.timeout = timeout
+
+    def submit(self, text):
+        return self.client.post_translation("ja", "en", text, priority="live")['id']
+
+    def wait(self, translation_id):
+        return self.client.get_translation(translation_id, wait=self.timeout)
+
+    def close(self):
+        self.client.close()
+
+
+class BackgroundLoad(object):
+
+    # Threads submitting batch translations for several users without waiting for them, while
+    # keeping at most window translations in flight each, to check that live latency is not affected.
+    def __init__(self, deployment, thread_count, sentence_counter, window=50):
+        self.stopped = threading.Event()
+        self.threads = [threading.Thread(target=self.run, args=(deployment, "bulk_{0}".format(i), sentence_counter, window), daemon=True) for i in range(0, thread_count)]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self, deployment, user_id, sentence_counter, window):
+        load_client = SocketLoadClient(deployment, 30)
+        in_flight = []
+        while not self.stopped.is_set():
+            in_flight.append(load_client.submit("バッチ の 文 {0} です".format(next(sentence_counter)), user_id=user_id, priority="batch"))
+            if len(in_flight) >= window:
+                load_client.wait(in_flight.pop(0), user_id=user_id)
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def run_level(deployment, load_client, concurrency, request_count, sentence_counter):
+    """Send request_count translations from concurrency threads, each waiting for its translation before sending the next one."""
+    submit_latencies = []
+    end_to_end_latencies = []
+    errors = [0]
+    remaining = itertools.count()
+    mutex = threading.Lock()
+
+    def run():
+        while next(remaining) < request_count:
+            text = "これ は ベンチマーク の 文 {0} です".format(next(sentence_counter))
+            start = timeit.default_timer()
+            try:
+                translation_id = load_client.submit(text)
+                submitted = timeit.default_timer()
+                translation = load_client.wait(translation_id)
+                completed = timeit.default_timer()
+                ok = translation.get('status') == 'PROCESSED'
+            except Exception:
+                ok = False
+            with mutex:
+                if ok:
+                    submit_latencies.append(submitted - start)
+                    end_to_end_latencies.append(completed - start)
+                else:
+                    errors[0] += 1
+
+    start = timeit.default_timer()
+    threads = [threading.Thread(target=run, daemon=True) for i in range(0, concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = timeit.default_timer() - start
+
+    return {'concurrency': concurrency, 'requests': request_count, 'completed': len(end_to_end_latencies), 'errors': errors[0],
+        'duration': duration, 'throughput': len(end_to_end_latencies) / duration if duration > 0 else 0,
+        'latency': {'submit': percentiles(submit_latencies), 'end_to_end': percentiles(end_to_end_latencies)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LectureMT end to end on a single machine", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--clients", help="Comma-separated list of load clients: socket (client.Client) and/or http (LectureMT_Http_Client)", default="socket")
+    parser.add_argument("--concurrency", help="Comma-separated list of concurrency levels", default="1,4,16")
+    parser.add_argument("--requests", help="Number of translations per concurrency level", type=int, default=200)
+    parser.add_argument("--warmup", help="Number of translations sent before each level and not measured", type=int, default=20)
+    parser.add_argument("--background", help="Number of users submitting batch translations in the background during each level", type=int, default=0)
+    parser.add_argument("--workers", help="Number of translation workers", type=int, default=2)
+    parser.add_argument("--engine", help="Engine of the server", choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument("--broker", help="local: local transport, rabbitmq: the broker of the config file", choices=['local', 'rabbitmq'], default='local')
+    parser.add_argument("--config", help="Config file read for the [RabbitMQ] section with --broker rabbitmq", default="conf/config.ini")
+    parser.add_argument("--batch-size", help="MaxBatchSize of the workers", type=int, default=1)
+    parser.add_argument("--batch-wait", help="MaxBatchWait of the workers in seconds", type=float, default=0.0)
+    parser.add_argument("--segmenter-latency", help="Latency per sentence of the segmenter", default="const:0")
+    parser.add_argument("--batch-latency", help="Latency per batch of the translation server", default="lognormal:0.005,0.3")
+    parser.add_argument("--sentence-latency", help="Additional latency per sentence of the translation server", default="const:0.001")
+    parser.add_argument("--timeout", help="Maximum number of seconds to wait for a translation", type=int, default=30)
+    parser.add_argument("--seed", help="Seed of the latency samplers", type=int, default=None)
+    parser.add_argument("--output", help="File to write the JSON report to, instead of the standard output", default=None)
+    args = parser.parse_args()
+
+    logging.getLogger("default").setLevel(logging.WARNING)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    clients = args.clients.split(',')
+    levels = [int(level) for level in args.concurrency.split(',')]
+    args.clients = clients
+    deployment = Deployment(args)
+    sentence_counter = itertools.count()
+
+    results = []
+    for client_type in clients:
+        for concurrency in levels:
+            if client_type == 'http':
+                load_client = HttpLoadClient(deployment, args.timeout, concurrency)
+            else:
+                load_client = SocketLoadClient(deployment, args.timeout)
+            background_load = BackgroundLoad(deployment, args.background, sentence_counter) if args.background > 0 else None
+            run_level(deployment, load_client, concurrency, args.warmup, sentence_counter)
+            deployment.reset_metrics()
+            result = run_level(deployment, load_client, concurrency, args.requests, sentence_counter)
+            if background_load is not None:
+                background_load.stop()
+            result['client'] = client_type
+            result['stages'] = deployment.get_metrics()
+            results.append(result)
+            load_client.close()
+
+    report = {'parameters': {key: value for key, value in vars(args).items() if key != 'output'}, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
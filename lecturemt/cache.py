@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""cache.py: Cache of the translations produced by a translation worker."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import collections
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class TranslationCache(object):
+
+    # Two tiers: an in-memory LRU and, optionally, a sqlite file that survives restarts.
+    #
+    # Every entry belongs to a namespace computed from the language pair and the description
+    # of the backend (type, address, servable, model version, etc.).  When the model behind a worker
+    # changes, the namespace changes too, so the old entries are never returned.  The entries
+    # of the previous namespace of the same cache name are removed from the disk when it is opened.
+    def __init__(self, name, lang_pair, backend_description, max_entries=100000, ttl=None, disk_path=None, max_disk_entries=1000000, logger=None):
+        self.name = name
+        self.namespace = hashlib.sha1("{0}|{1}".format(lang_pair, backend_description).encode('utf-8')).hexdigest()
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.disk_puts = 0
+        self.ttl = ttl
+        self.logger = logger
+        self.entries = collections.OrderedDict()
+        self.mutex = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, disk_path):
+        self.db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS translations (namespace TEXT, source TEXT, target TEXT, created REAL, PRIMARY KEY (namespace, source))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS translations_created ON translations (namespace, created)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS namespaces (name TEXT PRIMARY KEY, namespace TEXT)")
+        row = self.db.execute("SELECT namespace FROM namespaces WHERE name = ?", (self.name,)).fetchone()
+        if row is not None and row[0] != self.namespace:
+            if self.logger:
+                self.logger.info("The model of {0} has changed. Invalidating its cached translations.".format(self.name))
+            self.db.execute("DELETE FROM translations WHERE namespace = ?", (row[0],))
+        self.db.execute("INSERT OR REPLACE INTO namespaces (name, namespace) VALUES (?, ?)", (self.name, self.namespace))
+        if self.ttl is not None:
+            self.db.execute("DELETE FROM translations WHERE namespace = ? AND created < ?", (self.namespace, time.time() - self.ttl))
+
+    def _is_fresh(self, created):
+        return self.ttl is None or time.time() - created <= self.ttl
+
+    def _put_memory(self, key, value, created):
+        self.entries[key] = (value, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, text):
+        key = normalize_text(text)
+        with self.mutex:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if self._is_fresh(entry[1]):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self.entries[key]
+                self.evictions += 1
+
+            if self.db is not None:
+                row = self.db.execute("SELECT target, created FROM translations WHERE namespace = ? AND source = ?", (self.namespace, key)).fetchone()
+                if row is not None and self._is_fresh(row[1]):
+                    self._put_memory(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, text, translated_text):
+        key = normalize_text(text)
+        created = time.time()
+        with self.mutex:
+            self._put_memory(key, translated_text, created)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO translations (namespace, source, target, created) VALUES (?, ?, ?, ?)", (self.namespace, key, translated_text, created))
+                self.disk_puts += 1
+                if self.disk_puts % 1000 == 0:
+                    self._trim_disk()
+
+    def _trim_disk(self):
+        # Keep only the max_disk_entries most recent entries of the namespace.
+        self.db.execute("DELETE FROM translations WHERE namespace = ? AND created < "
+            "(SELECT created FROM translations WHERE namespace = ? ORDER BY created DESC LIMIT 1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_disk_entries - 1))
+
+    def invalidate(self):
+        with self.mutex:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM translations WHERE namespace = ?", (self.namespace,))
+
+    def get_stats(self):
+        with self.mutex:
+            return {'entries': len(self.entries), 'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'evictions': self.evictions}
@@ -6,37 +6,248 @@ __version__ = "1.0"
 __email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
 __status__ = "Development"
 
+import concurrent.futures
+import itertools
+import queue
 import socket
+import struct
 import sys
+import threading
 
 EOM = "==== EOM ===="
 
+FRAME_HEADER = struct.Struct('>I')
+
+MULTIPLEXED_MODE = b'M'
+MULTIPLEXED_FRAME_HEADER = struct.Struct('>II')
+
+# Seconds after which the multiplexed clients give up on a response.
+DEFAULT_TIMEOUT = 120
+
 class Client:
 
-    def __init__(self, host='localhost', port=46000, buffer_size=4096):
+    # With persistent=True, the requests are sent as frames over a connection that is kept open
+    # between calls and reopened when the server closed it.  Such a client must not be used
+    # by several threads at the same time.
+    def __init__(self, host='localhost', port=46000, buffer_size=4096, framed=False, persistent=False, timeout=None):
         self.host = host
         self.port = port
         self.buffer_size = buffer_size
+        self.framed = framed or persistent
+        self.persistent = persistent
+        self.timeout = timeout
+        self.sock = None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _connect(self):
+        s = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return s
+
+    def _recv_exactly(self, s, size):
+        chunks = []
+        while size > 0:
+            data = s.recv(min(size, self.buffer_size))
+            if not data:
+                raise ConnectionError("Connection closed by the server.")
+            chunks.append(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def _exchange_frame(self, s, payload):
+        s.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+        (size,) = FRAME_HEADER.unpack(self._recv_exactly(s, FRAME_HEADER.size))
+        return self._recv_exactly(s, size).decode('utf-8')
+
+    def submit_framed(self, text):
+        payload = text.encode('utf-8')
+        if not self.persistent:
+            s = self._connect()
+            try:
+                return self._exchange_frame(s, payload)
+            finally:
+                s.close()
+
+        # A kept connection may have been closed by the server in the meantime,
+        # in which case the request is sent once more on a new connection.
+        for attempt in range(0, 2):
+            reused = self.sock is not None
+            if self.sock is None:
+                self.sock = self._connect()
+            try:
+                return self._exchange_frame(self.sock, payload)
+            except (OSError, ConnectionError):
+                self.close()
+                if not reused or attempt == 1:
+                    raise
+
+    def submit_stream(self, text):
+        """Submit a streaming request (like watch_translations) and generate each response as it arrives."""
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.connect((self.host, self.port))
+            if self.framed:
+                payload = text.encode('utf-8')
+                s.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+                while True:
+                    (size,) = FRAME_HEADER.unpack(self._recv_exactly(s, FRAME_HEADER.size))
+                    response = self._recv_exactly(s, size).decode('utf-8')
+                    yield response
+                    if response.startswith('{"pending":'):
+                        break
+            else:
+                s.sendall((text + EOM).encode('utf-8'))
+                # In EOM mode, the responses are separated by newlines.
+                with s.makefile('rb') as reader:
+                    for line in reader:
+                        yield line.decode('utf-8').rstrip('\n')
+        finally:
+            s.close()
 
     def submit(self, text):
+        if self.framed:
+            return self.submit_framed(text)
+
         text += EOM
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.connect((self.host, self.port))
         s.send(text.encode('utf-8'))
-        response = ''
+        response = b''
         try: 
             while True:
                 try:
                     resp = s.recv(self.buffer_size)
                     if resp:
-                        response += resp.decode('utf-8')
+                        response += resp
                     else:
                         break
                 except:
                     break
         finally:
             s.close()
-        return response
+        return response.decode('utf-8')
+
+class MultiplexedClient:
+
+    # Keeps a single connection open and lets several threads send requests over it at the same time.
+    # Each request gets an id that the server puts back in its response, so responses are matched
+    # to their requests whatever the order in which they arrive.  A reader thread receives the responses.
+    # submit() gives up after timeout seconds, which must be longer than the longest wait (MaxWait of the server).
+    def __init__(self, host='localhost', port=46000, buffer_size=65536, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.sock = None
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.mutex = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(MULTIPLEXED_MODE)
+        reader = threading.Thread(target=self._read_responses, args=(sock,))
+        reader.daemon = True
+        reader.start()
+        return sock
+
+    def _read_responses(self, sock):
+        try:
+            with sock.makefile('rb', buffering=self.buffer_size) as stream:
+                while True:
+                    header = stream.read(MULTIPLEXED_FRAME_HEADER.size)
+                    if len(header) < MULTIPLEXED_FRAME_HEADER.size:
+                        break
+                    (size, request_id) = MULTIPLEXED_FRAME_HEADER.unpack(header)
+                    data = stream.read(size)
+                    if len(data) < size:
+                        break
+                    with self.mutex:
+                        future = self.pending.pop(request_id, None)
+                    if future is not None:
+                        future.set_result(data.decode('utf-8'))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._fail(sock, ConnectionError("Connection closed by the server."))
+
+    def _fail(self, sock, error):
+        # All the requests sent over the lost connection fail; the next request will reconnect.
+        with self.mutex:
+            if self.sock is not sock:
+                return
+            self.sock = None
+            pending = self.pending
+            self.pending = {}
+        sock.close()
+        for future in pending.values():
+            future.set_exception(error)
+
+    def submit_async(self, text):
+        """Send the request and return a concurrent.futures.Future of its response."""
+        payload = text.encode('utf-8')
+        future = concurrent.futures.Future()
+        with self.mutex:
+            if self.sock is None:
+                self.sock = self._connect()
+            sock = self.sock
+            request_id = next(self.request_ids) & 0xFFFFFFFF
+            self.pending[request_id] = future
+        future.request_id = request_id
+        try:
+            with self.write_lock:
+                sock.sendall(MULTIPLEXED_FRAME_HEADER.pack(len(payload), request_id) + payload)
+        except OSError as e:
+            self._fail(sock, e)
+        return future
+
+    def submit(self, text):
+        future = self.submit_async(text)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            # A late response will be ignored.
+            with self.mutex:
+                if self.pending.get(future.request_id) is future:
+                    del self.pending[future.request_id]
+            raise
+
+    def close(self):
+        with self.mutex:
+            sock = self.sock
+        if sock is not None:
+            self._fail(sock, ConnectionError("Client closed."))
+
+class ClientPool:
+
+    # Small pool of multiplexed connections that can be shared by several threads.
+    # The requests are spread over the connections in turn.
+    def __init__(self, host='localhost', port=46000, size=2, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.clients = [MultiplexedClient(host, port, timeout=timeout) for i in range(0, size)]
+        self.next_client = itertools.cycle(self.clients)
+
+    def submit_async(self, text):
+        return next(self.next_client).submit_async(text)
+
+    def submit(self, text):
+        return next(self.next_client).submit(text)
+
+    def submit_stream(self, text):
+        # Streaming requests hold their connection until the end so they get their own.
+        return Client(self.host, self.port, framed=True, timeout=self.timeout).submit_stream(text)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
 
 def main():
     import argparse
@@ -44,9 +255,10 @@ def main():
     parser.add_argument("--host", help = "Host of the server", default = 'localhost')
     parser.add_argument("--port", help = "Port of the server", default = 46000)
     parser.add_argument("--bufsize", help = "Size of the buffer", default = 4096)
+    parser.add_argument("--framed", help = "Use length-prefixed frames instead of the EOM delimiter", action = "store_true")
     args = parser.parse_args()
 
-    client = Client(args.host, int(args.port), buffer_size=int(args.bufsize))
+    client = Client(args.host, int(args.port), buffer_size=int(args.bufsize), framed=args.framed)
     request = ''
     for line in sys.stdin:
         request += line
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""cluster.py: Placement of the users and translations on the instances of the LectureMT server."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import bisect
+import collections
+import hashlib
+import uuid
+
+
+def get_servers(config):
+    """
+    Return the instances of the server listed in the Servers key of the [Cluster] section of config.ini
+    (id=host:port, separated by commas) as an OrderedDict of id -> (host, port).
+    The dict is empty when the server is not deployed as a cluster.
+    """
+    servers = collections.OrderedDict()
+    if not 'Cluster' in config:
+        return servers
+    for server in config['Cluster'].get('Servers', '').split(','):
+        if server.strip():
+            (instance_id, address) = server.strip().split('=')
+            (host, port) = address.strip().rsplit(':', 1)
+            servers[instance_id.strip()] = (host, int(port))
+    return servers
+
+
+class HashRing(object):
+
+    # Consistent hashing: each instance is placed at replicas points of a ring of 64-bit hashes
+    # and a key belongs to the instance of the first point at or after its own hash.
+    # When an instance is added or removed, only the keys of about one instance out of N move.
+    def __init__(self, instance_ids, replicas=100):
+        points = sorted((self._hash("{0}#{1}".format(instance_id, i)), instance_id) for instance_id in instance_ids for i in range(0, replicas))
+        self.hashes = [h for (h, instance_id) in points]
+        self.instance_ids = [instance_id for (h, instance_id) in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get(self, key):
+        i = bisect.bisect_left(self.hashes, self._hash(key))
+        return self.instance_ids[i % len(self.instance_ids)]
+
+
+class Placement(object):
+
+    # The translations of a user are all kept by the instance the user belongs to, so that listing
+    # or watching them only involves one instance.  The ids of the translations are chosen so that
+    # they also belong to that instance: the REST API can then send a lookup by id to the instance
+    # keeping the translation without knowing its owner (for the admin user, for instance).
+    def __init__(self, instance_ids, replicas=100):
+        self.ring = HashRing(instance_ids, replicas)
+
+    def get_instance_of_user(self, user_id):
+        return self.ring.get("user:{0}".format(user_id))
+
+    def get_instance_of_translation(self, translation_id):
+        return self.ring.get(translation_id)
+
+    def new_translation_id(self, instance_id):
+        # With N instances, N uuids are drawn on average.
+        while True:
+            id = str(uuid.uuid4())
+            if self.ring.get(id) == instance_id:
+                return id
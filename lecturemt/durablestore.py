@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""durablestore.py: Translation store persisted with an append-only log and periodic snapshots."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import json
+import logging
+import os
+import pickle
+import queue
+import re
+import threading
+import time
+import timeit
+
+from record import TranslationRecord, pack_id, to_json, unpack_id
+from store import TranslationStore
+
+log = logging.getLogger("default")
+
+LOG_FILE = re.compile(r'^log\.(\d+)\.jsonl$')
+SNAPSHOT_FILE = re.compile(r'^snapshot\.(\d+)\.pickle$')
+
+# Number of records pickled together in a snapshot.
+SNAPSHOT_CHUNK_SIZE = 10000
+
+# Seconds between two snapshots while the log cannot be written.
+SNAPSHOT_RETRY_DELAY = 10
+
+
+def log_file_name(seq):
+    return "log.{0:012d}.jsonl".format(seq)
+
+
+def snapshot_file_name(seq):
+    return "snapshot.{0:012d}.pickle".format(seq)
+
+
+class JournalWriter(threading.Thread):
+
+    # Appends the changes of the store to the current log file.  The changes are written in batches:
+    # everything queued since the previous batch is written and then synced to disk with a single fsync,
+    # so that the callers of sync() only wait for the batch holding their changes.
+    #
+    # When the log cannot be written (disk full, I/O error), the error is kept in failed, the changes are
+    # dropped and sync() returns False: the store keeps working in memory only.  Writing resumes in the
+    # new file of the next rotation, and the snapshot taken right after it covers the dropped changes.
+    def __init__(self, directory, seq):
+        threading.Thread.__init__(self)
+        self.name = "JournalWriter"
+        self.daemon = True
+        self.directory = directory
+        self.seq = seq
+        self.pending = queue.Queue()
+        self.failed = None
+        self.file = open(os.path.join(self.directory, log_file_name(self.seq)), 'ab')
+
+    def put(self, translation):
+        self.pending.put(('put', translation))
+
+    def remove(self, id):
+        self.pending.put(('remove', id))
+
+    def rotate(self, seq):
+        """Continue the log in a new file.  Return an event set once the previous file is closed."""
+        rotated = threading.Event()
+        self.pending.put(('rotate', (seq, rotated)))
+        return rotated
+
+    def sync(self):
+        """Return once the changes made so far are written, True if they could be written."""
+        synced = threading.Event()
+        self.pending.put(('sync', synced))
+        synced.wait()
+        return self.failed is None
+
+    def _write(self, lines):
+        if self.failed is None:
+            try:
+                if lines:
+                    self.file.write(b''.join(lines))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except Exception as e:
+                self._fail(e)
+        lines.clear()
+
+    def _fail(self, error):
+        if self.failed is None:
+            log.error("Cannot write the log of the translation store in {0}: {1}.  The changes are only kept in memory until the next snapshot.".format(self.directory, error))
+        self.failed = error
+
+    def _rotate(self, seq):
+        try:
+            self.file.close()
+        except Exception as e:
+            self._fail(e)
+        self.seq = seq
+        try:
+            self.file = open(os.path.join(self.directory, log_file_name(self.seq)), 'ab')
+        except Exception as e:
+            self._fail(e)
+            return
+        if self.failed is not None:
+            log.info("The log of the translation store continues in {0}.".format(log_file_name(self.seq)))
+            self.failed = None
+
+    def run(self):
+        while True:
+            batch = [self.pending.get(True)]
+            try:
+                while len(batch) < 10000:
+                    batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                pass
+
+            lines = []
+            try:
+                for (op, value) in batch:
+                    if op == 'put':
+                        if self.failed is None:
+                            lines.append(json.dumps({'put': value}, ensure_ascii=False, default=to_json).encode('utf-8') + b'\n')
+                    elif op == 'remove':
+                        if self.failed is None:
+                            lines.append(json.dumps({'remove': unpack_id(value)}, ensure_ascii=False).encode('utf-8') + b'\n')
+                    elif op == 'rotate':
+                        self._write(lines)
+                        self._rotate(value[0])
+                self._write(lines)
+            except Exception as e:
+                self._fail(e)
+            finally:
+                # The waiters are always woken up, even if the changes could not be written.
+                for (op, value) in batch:
+                    if op == 'rotate':
+                        value[1].set()
+                    elif op == 'sync':
+                        value.set()
+
+
+class Snapshotter(threading.Thread):
+
+    # Takes a snapshot of the store every snapshot_interval seconds, or sooner when more than
+    # snapshot_log_records changes have been logged since the previous one, so that a restart
+    # only has to replay a short log.
+    def __init__(self, store, snapshot_interval, snapshot_log_records):
+        threading.Thread.__init__(self)
+        self.name = "Snapshotter"
+        self.daemon = True
+        self.store = store
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_log_records = snapshot_log_records
+
+    def run(self):
+        last_snapshot = time.time()
+        while True:
+            time.sleep(1)
+            records = self.store.log_records
+            # While the log cannot be written, only a snapshot saves the changes.
+            retry = self.store.writer.failed is not None and time.time() - last_snapshot >= SNAPSHOT_RETRY_DELAY
+            if retry or records >= self.snapshot_log_records or (records > 0 and time.time() - last_snapshot >= self.snapshot_interval):
+                try:
+                    self.store.snapshot()
+                except Exception as e:
+                    log.error("Cannot take a snapshot of the translation store: {0}".format(e))
+                last_snapshot = time.time()
+
+
+class DurableTranslationStore(TranslationStore):
+
+    # The records are kept in memory, like with TranslationStore, and every change is also appended
+    # to a log file: {"put": record} for an added or updated record, {"remove": id} for a removed one.
+    # As the records are replaced as a whole, replaying a change more than once is harmless.
+    #
+    # A snapshot is a sequence of pickled lists of records, which loads several times faster than JSON.
+    # The snapshots are only read by the server that wrote them.  Snapshot N is taken after the log has
+    # moved on to the file log.N, so that snapshot N plus the files log.N, log.N+1... give the current
+    # state of the store, even if the records were changed while the snapshot was being written.
+    # The files older than the last complete snapshot are then deleted.
+    #
+    # At startup, the last snapshot is streamed chunk by chunk and only the log files written after it are
+    # replayed.  A line cut short by a crash at the end of a log file is ignored.  The log then
+    # continues in a new file.
+    def __init__(self, directory, stripe_count=64, snapshot_interval=600, snapshot_log_records=1000000):
+        TranslationStore.__init__(self, stripe_count)
+        self.directory = directory
+        self.log_records = 0
+        self.snapshot_mutex = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.writer = None
+        seq = self.load()
+        self.seq = seq
+        self.writer = JournalWriter(self.directory, self.seq)
+        self.writer.start()
+        self.snapshotter = Snapshotter(self, snapshot_interval, snapshot_log_records)
+        self.snapshotter.start()
+
+    def _on_put(self, translation):
+        if self.writer is not None:
+            self.writer.put(translation)
+            self.log_records += 1
+
+    def _on_remove(self, id):
+        if self.writer is not None:
+            self.writer.remove(id)
+            self.log_records += 1
+
+    def sync(self):
+        return self.writer.sync()
+
+    def _load_record(self, translation):
+        # Like add, without locks nor logging: nothing else uses the store while it is loaded.
+        id = pack_id(translation['id'])
+        owner = translation['owner']
+        self.stripes[self._stripe_of(id)][id] = translation
+        self.owner_stripes[self._stripe_of(owner)].setdefault(owner, set()).add(id)
+
+    def _list_files(self, pattern):
+        files = []
+        for file_name in os.listdir(self.directory):
+            match = pattern.match(file_name)
+            if match:
+                files.append((int(match.group(1)), file_name))
+        return sorted(files)
+
+    def load(self):
+        """Load the last snapshot and replay the log files written after it.  Return the number of the next log file."""
+        start = timeit.default_timer()
+        # Left by a snapshot that was interrupted.
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, file_name))
+        snapshots = self._list_files(SNAPSHOT_FILE)
+        logs = self._list_files(LOG_FILE)
+        snapshot_seq = snapshots[-1][0] if snapshots else 0
+        if snapshots:
+            with open(os.path.join(self.directory, snapshots[-1][1]), 'rb') as snapshot_file:
+                while True:
+                    try:
+                        translations = pickle.load(snapshot_file)
+                    except EOFError:
+                        break
+                    for translation in translations:
+                        self._load_record(translation)
+        replayed = 0
+        for (seq, file_name) in logs:
+            if seq < snapshot_seq:
+                continue
+            with open(os.path.join(self.directory, file_name), 'r', encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        log.warning("Truncated record at the end of {0} ignored.".format(file_name))
+                        break
+                    if 'put' in change:
+                        self._load_record(TranslationRecord.from_dict(change['put']))
+                    else:
+                        self.remove(change['remove'])
+                    replayed += 1
+        # The number of changes still to be covered by a snapshot.
+        self.log_records = replayed
+        log.info("Translation store loaded from {0}: {1} records, {2} log records replayed in {3:.2f} s.".format(self.directory, len(self), replayed, timeit.default_timer() - start))
+        return max([snapshot_seq] + [seq for (seq, file_name) in logs]) + 1
+
+    def snapshot(self):
+        with self.snapshot_mutex:
+            start = timeit.default_timer()
+            self.seq += 1
+            seq = self.seq
+            self.log_records = 0
+            self.writer.rotate(seq).wait()
+
+            # The records are never modified in place, so they can be written without holding their lock.
+            temp_path = os.path.join(self.directory, snapshot_file_name(seq) + ".tmp")
+            translations = self.values()
+            with open(temp_path, 'wb') as snapshot_file:
+                for i in range(0, len(translations), SNAPSHOT_CHUNK_SIZE):
+                    pickle.dump(translations[i:i + SNAPSHOT_CHUNK_SIZE], snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(temp_path, os.path.join(self.directory, snapshot_file_name(seq)))
+            directory_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+
+            for (old_seq, file_name) in self._list_files(SNAPSHOT_FILE) + self._list_files(LOG_FILE):
+                if old_seq < seq:
+                    os.remove(os.path.join(self.directory, file_name))
+            log.info("Snapshot {0} of the translation store: {1} records in {2:.2f} s.".format(seq, len(translations), timeit.default_timer() - start))
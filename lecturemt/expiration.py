@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""expiration.py: Time-ordered index used to expire the translations kept by the server."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import heapq
+import threading
+
+
+class ExpirationPolicy(object):
+
+    # The time-to-live of a translation is looked up in this order:
+    # [ExpirationByUser] (key: user id), [ExpirationByLanguagePair] (key: lang pair like ja-en)
+    # and finally DefaultTTL from the [Expiration] section.
+    def __init__(self, config, default_ttl=600):
+        self.default_ttl = float(config['Expiration'].get('DefaultTTL', default_ttl)) if 'Expiration' in config else float(default_ttl)
+        self.ttl_by_user = {k: float(v) for k, v in config['ExpirationByUser'].items()} if 'ExpirationByUser' in config else {}
+        self.ttl_by_lang_pair = {k: float(v) for k, v in config['ExpirationByLanguagePair'].items()} if 'ExpirationByLanguagePair' in config else {}
+
+    def get_ttl(self, user_id, lang_pair):
+        # configparser lowercases the keys.
+        if user_id.lower() in self.ttl_by_user:
+            return self.ttl_by_user[user_id.lower()]
+        if lang_pair.lower() in self.ttl_by_lang_pair:
+            return self.ttl_by_lang_pair[lang_pair.lower()]
+        return self.default_ttl
+
+
+class ExpirationIndex(object):
+
+    # Min-heap of (deadline, id) where deadline is an epoch in seconds.
+    # Entries are never removed from the heap when a translation is deleted beforehand;
+    # they are simply ignored when they become due and the translation is not found anymore.
+    def __init__(self):
+        self.heap = []
+        self.mutex = threading.Lock()
+        self.evictions = 0
+        self.runs = 0
+        self.last_pause = 0.0
+        self.max_pause = 0.0
+        self.total_pause = 0.0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, id, deadline):
+        with self.mutex:
+            heapq.heappush(self.heap, (deadline, id))
+
+    def pop_due(self, now, max_count=1000):
+        """Return the ids of at most max_count entries whose deadline is not after now."""
+        ids = []
+        with self.mutex:
+            while self.heap and self.heap[0][0] <= now and len(ids) < max_count:
+                ids.append(heapq.heappop(self.heap)[1])
+        return ids
+
+    def record_run(self, evictions, pause):
+        with self.mutex:
+            self.runs += 1
+            self.evictions += evictions
+            self.last_pause = pause
+            self.max_pause = max(self.max_pause, pause)
+            self.total_pause += pause
+
+    def get_stats(self):
+        with self.mutex:
+            return {'pending': len(self.heap), 'evictions': self.evictions, 'runs': self.runs,
+                'last_pause': self.last_pause, 'max_pause': self.max_pause, 'total_pause': self.total_pause}
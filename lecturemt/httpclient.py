@@ -1,122 +1,241 @@
 #!/usr/bin/env python3
 
-from http.client import HTTPSConnection
+from http.client import HTTPConnection, HTTPSConnection
 from base64 import b64encode
+import asyncio
 import json
 import logging
+import queue
+import ssl
+import time
 
 class LectureMT_Http_Client:
 
     max_attempts = 3
 
-    def __init__(self, endpoint, username, password):
+    # Delay before the second attempt.  It is doubled for each following attempt.
+    retry_delay = 0.1
+
+    # The connections are kept alive and reused between calls.  They are checked out from
+    # a pool so that a single client can be shared by several threads.
+    # use_ssl=False is only meant for local setups like the benchmark.
+    def __init__(self, endpoint, username, password, pool_size=10, timeout=10, use_ssl=True):
         self.server = endpoint[0:endpoint.index('/')]
         self.service_prefix = endpoint[endpoint.index('/'):]
         self.username = username
         self.password = password
+        self.timeout = timeout
+        self.connection_class = HTTPSConnection if use_ssl else HTTPConnection
+        usernameAndPassword = b64encode("{0}:{1}".format(self.username, self.password).encode('utf-8')).decode('ascii')
+        self.headers = { 'Authorization': 'Basic {0}'.format(usernameAndPassword),
+                         'Accept': 'application/json',
+                         'Connection': 'keep-alive' }
+        self.pool = queue.LifoQueue(maxsize=pool_size)
 
-    def get_translations(self):
-        for i in range(0, LectureMT_Http_Client.max_attempts):
-            logging.debug("get_translations attempt {0}".format(i))
-            con = HTTPSConnection(self.server, timeout=10)
+    def _checkout(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.server, timeout=self.timeout)
+
+    def _checkin(self, con):
+        try:
+            self.pool.put_nowait(con)
+        except queue.Full:
+            con.close()
+
+    def close(self):
+        while True:
             try:
-                usernameAndPassword = b64encode("{0}:{0}".format(self.username, self.password).encode('utf-8')).decode('ascii')
-                headers = { 'Authorization': 'Basic {0}'.format(usernameAndPassword),
-                            'Accept': 'application/json' }
-                logging.debug("before request")
-                x = con.request('GET', '{0}/translations'.format(self.service_prefix), headers=headers)
-                logging.debug("after request x={0}".format(x))
-                response = con.getresponse()
-                logging.debug("get_translations before read")
-                data = response.read()
-                logging.debug("get_translations after read")
-                if len(data) > 0:
-                    json_data = json.loads(data.decode('utf-8'))
-                    return json_data
-            except Exception as ex:
-                logging.debug("This error occurred: {0}\nTrying one more time...".format(ex))
-            finally:
-                con.close()
-        logging.debug("Hmmm, data is empty after 3 attempts!!!")
-        return {}
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
 
-    def get_translation(self, trans_id):
+    def _request(self, name, method, path, body=None, timeout=None):
         for i in range(0, LectureMT_Http_Client.max_attempts):
-            logging.debug("get_translation attempt {0}".format(i))
-            con = HTTPSConnection(self.server, timeout=10)
+            if i > 0:
+                time.sleep(LectureMT_Http_Client.retry_delay * 2 ** (i - 1))
+            logging.debug("{0} attempt {1}".format(name, i))
+            con = self._checkout()
+            keep = False
             try:
-                usernameAndPassword = b64encode("{0}:{0}".format(self.username, self.password).encode('utf-8')).decode('ascii')
-                headers = { 'Authorization': 'Basic {0}'.format(usernameAndPassword),
-                            'Accept': 'application/json' }
-                logging.debug("before request")
-                x = con.request('GET', '{0}/translation/{1}'.format(self.service_prefix, trans_id), headers=headers)
-                logging.debug("after request x={0}".format(x))
+                con.timeout = timeout if timeout is not None else self.timeout
+                if con.sock is not None:
+                    con.sock.settimeout(con.timeout)
+                con.request(method, '{0}{1}'.format(self.service_prefix, path), body, headers=self.headers)
                 response = con.getresponse()
-                logging.debug("get_translation before read")
                 data = response.read()
-                logging.debug("get_translation after read")
+                keep = not response.will_close
+                logging.debug("{0} after read".format(name))
                 if len(data) > 0:
                     json_data = json.loads(data.decode('utf-8'))
                     return json_data
             except Exception as ex:
                 logging.debug("This error occurred: {0}\nTrying one more time...".format(ex))
             finally:
-                con.close()
-        logging.debug("Hmmm, data is empty!!!")
+                if keep:
+                    self._checkin(con)
+                else:
+                    con.close()
+        logging.debug("Hmmm, data is empty after {0} attempts!!!".format(LectureMT_Http_Client.max_attempts))
         return {}
 
-    def post_translation(self, lang_src, lang_tgt, text):
+    def get_translations(self):
+        return self._request("get_translations", 'GET', '/translations')
+
+    def get_translation(self, trans_id, wait=None):
+        if wait is None:
+            return self._request("get_translation", 'GET', '/translation/{0}'.format(trans_id))
+        return self._request("get_translation", 'GET', '/translation/{0}?wait={1}'.format(trans_id, wait), timeout=self.timeout + wait)
+
+    def post_translation(self, lang_src, lang_tgt, text, priority=None, segment_key=None):
+        """
+        priority is live or batch.  When not given, the default priority of the user is used.
+        Texts posted with the same segment_key are revisions of the same segment and share the same translation.
+        """
         post_data = { "lang_source": lang_src, "lang_target": lang_tgt, "text_source": text }
-        str_post_data = json.dumps(post_data)
-        for i in range(0, LectureMT_Http_Client.max_attempts):
-            logging.debug("post_translation attempt {0}".format(i))
-            con = HTTPSConnection(self.server, timeout=10)
-            try:
-                usernameAndPassword = b64encode("{0}:{0}".format(self.username, self.password).encode('utf-8')).decode('ascii')
-                headers = { 'Authorization': 'Basic {0}'.format(usernameAndPassword), 'Accept': 'application/json' } 
-                logging.debug("before request")
-                x = con.request('POST', '{0}/translation'.format(self.service_prefix), str_post_data, headers=headers)
-                logging.debug("after request x={0}".format(x))
-                response = con.getresponse()
-                logging.debug("post_data before read")
-                data = response.read()
-                logging.debug("post_data after read")
-                if len(data) > 0:
-                    json_data = json.loads(data.decode('utf-8'))
-                    return json_data
-            except Exception as ex:
-                logging.debug("This error occurred: {0}\nTrying one more time...".format(ex))
-            finally:
-                con.close()
+        if priority is not None:
+            post_data["priority"] = priority
+        if segment_key is not None:
+            post_data["segment_key"] = segment_key
+        return self._request("post_translation", 'POST', '/translation', json.dumps(post_data))
+
+    def post_document(self, lang_src, lang_tgt, sentences, priority=None):
+        """Submit several sentences with a single call. The sentences are translated in parallel."""
+        post_data = { "lang_source": lang_src, "lang_target": lang_tgt, "sentences": sentences }
+        if priority is not None:
+            post_data["priority"] = priority
+        return self._request("post_document", 'POST', '/document', json.dumps(post_data))
 
-        logging.debug("Hmmm, data is empty!!!")
-        return {}
-        
     def delete_translation(self, trans_id):
-        for i in range(0, LectureMT_Http_Client.max_attempts):
-            logging.debug("delete_translation attempt {0}".format(i))
-            con = HTTPSConnection(self.server, timeout=10)
-            try:
-                usernameAndPassword = b64encode("{0}:{0}".format(self.username, self.password).encode('utf-8')).decode('ascii')
-                headers = { 'Authorization': 'Basic {0}'.format(usernameAndPassword), 
-                            'Accept': 'application/json' }
-                logging.debug("before request")
-                x = con.request('DELETE', '{0}/translation/{1}'.format(self.service_prefix, trans_id), headers=headers)
-                logging.debug("after request x={0}".format(x))
-                response = con.getresponse()
-                logging.debug("delete_translation before read")
-                data = response.read()
-                logging.debug("delete_translation after read")
-                if len(data) > 0:
-                    json_data = json.loads(data.decode('utf-8'))
-                    return json_data
-            except Exception as ex:
-                logging.debug("This error occurred: {0}\nTrying one more time...".format(ex))
-            finally:
-                con.close()
-        logging.debug("Hmmm, data is empty!!!")
+        return self._request("delete_translation", 'DELETE', '/translation/{0}'.format(trans_id))
+
+
+class LectureMT_Async_Http_Client:
+
+    # Same calls as LectureMT_Http_Client but as coroutines, so that a single thread
+    # can drive many concurrent requests.  At most pool_size connections are opened;
+    # they are kept alive and reused.  The timeout applies to each step of a request:
+    # connecting, sending the request and reading the response.
+    def __init__(self, endpoint, username, password, pool_size=100, timeout=10, use_ssl=True):
+        self.server = endpoint[0:endpoint.index('/')]
+        self.service_prefix = endpoint[endpoint.index('/'):]
+        self.host, _, port = self.server.partition(':')
+        self.port = int(port) if port else (443 if use_ssl else 80)
+        self.timeout = timeout
+        usernameAndPassword = b64encode("{0}:{1}".format(username, password).encode('utf-8')).decode('ascii')
+        self.headers = { 'Host': self.server,
+                         'Authorization': 'Basic {0}'.format(usernameAndPassword),
+                         'Accept': 'application/json',
+                         'Connection': 'keep-alive' }
+        self.ssl_context = ssl.create_default_context() if use_ssl else None
+        self.pool_size = pool_size
+        self.idle = []
+        self.semaphore = None
+
+    async def _open(self):
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl_context), self.timeout)
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server.")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b''.join(chunks)
+            will_close = headers.get('connection', '').lower() == 'close'
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+            will_close = headers.get('connection', '').lower() == 'close'
+        else:
+            data = await reader.read()
+            will_close = True
+        return (status, data, will_close)
+
+    async def _request(self, name, method, path, body=None, timeout=None):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.pool_size)
+        payload = body.encode('utf-8') if body is not None else b''
+        headers = dict(self.headers)
+        headers['Content-Length'] = str(len(payload))
+        request = "{0} {1}{2} HTTP/1.1\r\n".format(method, self.service_prefix, path) + \
+            ''.join("{0}: {1}\r\n".format(k, v) for k, v in headers.items()) + "\r\n"
+        request = request.encode('utf-8') + payload
+
+        async with self.semaphore:
+            for i in range(0, LectureMT_Http_Client.max_attempts):
+                if i > 0:
+                    await asyncio.sleep(LectureMT_Http_Client.retry_delay * 2 ** (i - 1))
+                logging.debug("{0} attempt {1}".format(name, i))
+                connection = self.idle.pop() if self.idle else None
+                keep = False
+                try:
+                    if connection is None:
+                        connection = await self._open()
+                    (reader, writer) = connection
+                    writer.write(request)
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                    (status, data, will_close) = await asyncio.wait_for(self._read_response(reader), timeout if timeout is not None else self.timeout)
+                    keep = not will_close
+                    if len(data) > 0:
+                        return json.loads(data.decode('utf-8'))
+                except Exception as ex:
+                    logging.debug("This error occurred: {0}\nTrying one more time...".format(ex))
+                finally:
+                    if connection is not None:
+                        if keep:
+                            self.idle.append(connection)
+                        else:
+                            connection[1].close()
+        logging.debug("Hmmm, data is empty after {0} attempts!!!".format(LectureMT_Http_Client.max_attempts))
         return {}
 
+    async def close(self):
+        while self.idle:
+            (reader, writer) = self.idle.pop()
+            writer.close()
+
+    async def get_translations(self):
+        return await self._request("get_translations", 'GET', '/translations')
+
+    async def get_translation(self, trans_id, wait=None):
+        if wait is None:
+            return await self._request("get_translation", 'GET', '/translation/{0}'.format(trans_id))
+        return await self._request("get_translation", 'GET', '/translation/{0}?wait={1}'.format(trans_id, wait), timeout=self.timeout + wait)
+
+    async def post_translation(self, lang_src, lang_tgt, text, priority=None, segment_key=None):
+        post_data = { "lang_source": lang_src, "lang_target": lang_tgt, "text_source": text }
+        if priority is not None:
+            post_data["priority"] = priority
+        if segment_key is not None:
+            post_data["segment_key"] = segment_key
+        return await self._request("post_translation", 'POST', '/translation', json.dumps(post_data))
+
+    async def post_document(self, lang_src, lang_tgt, sentences, priority=None):
+        post_data = { "lang_source": lang_src, "lang_target": lang_tgt, "sentences": sentences }
+        if priority is not None:
+            post_data["priority"] = priority
+        return await self._request("post_document", 'POST', '/document', json.dumps(post_data))
+
+    async def delete_translation(self, trans_id):
+        return await self._request("delete_translation", 'DELETE', '/translation/{0}'.format(trans_id))
+
 # def main():
 #     import argparse
 #     parser = argparse.ArgumentParser(description= "Send a request to the LectureMT Server", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""localbroker.py: In-process stand-in for RabbitMQ exposing the subset of the pika API used by LectureMT."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import collections
+import itertools
+import queue
+import threading
+import timeit
+
+
+class exceptions:
+
+    class UnroutableError(Exception):
+        pass
+
+    class ChannelClosedByBroker(Exception):
+
+        def __init__(self, reply_code, reply_text):
+            Exception.__init__(self, reply_code, reply_text)
+            self.reply_code = reply_code
+            self.reply_text = reply_text
+
+
+class PlainCredentials(object):
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+
+
+class ConnectionParameters(object):
+
+    def __init__(self, host='localhost', port=5672, credentials=None, **kwargs):
+        self.host = host
+        self.port = port
+        self.credentials = credentials
+
+
+class BasicProperties(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Method(object):
+
+    def __init__(self, delivery_tag=None, message_count=0, queue=None, redelivered=False):
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+        self.message_count = message_count
+        self.queue = queue
+
+
+class QueueDeclareResult(object):
+
+    def __init__(self, queue, message_count):
+        self.method = Method(message_count=message_count, queue=queue)
+
+
+class Broker(object):
+
+    # Messages are kept in memory only.  Each queue holds its ready messages and its consumers.
+    # A message is handed to the next consumer (in round-robin order) whose number of
+    # unacknowledged messages is below its prefetch count, like RabbitMQ does.
+    # A message published with an expiration (in milliseconds, as a string) is dropped if it is
+    # still in its queue when it expires.  Exchanges are all of the fanout type: a message
+    # published to an exchange is copied to all the queues bound to it.  A message that is requeued
+    # is flagged as redelivered when it is delivered again.
+    def __init__(self):
+        self.queues = {}
+        self.consumers = {}
+        self.next_consumer = {}
+        self.exchanges = {}
+        self.queue_ids = itertools.count(1)
+        self.mutex = threading.Lock()
+
+    def declare(self, queue_name, passive=False):
+        with self.mutex:
+            if queue_name == '':
+                queue_name = "amq.gen-{0}".format(next(self.queue_ids))
+            if not queue_name in self.queues:
+                # As with RabbitMQ, a passive declaration only checks that the queue exists.
+                if passive:
+                    raise exceptions.ChannelClosedByBroker(404, "NOT_FOUND - no queue '{0}'".format(queue_name))
+                self.queues[queue_name] = collections.deque()
+                self.consumers[queue_name] = []
+                self.next_consumer[queue_name] = 0
+            self._drop_expired(queue_name)
+            return (queue_name, len(self.queues[queue_name]))
+
+    def delete(self, queue_name):
+        with self.mutex:
+            self.queues.pop(queue_name, None)
+            self.consumers.pop(queue_name, None)
+            self.next_consumer.pop(queue_name, None)
+            for queue_names in self.exchanges.values():
+                queue_names.discard(queue_name)
+
+    def declare_exchange(self, exchange_name):
+        with self.mutex:
+            self.exchanges.setdefault(exchange_name, set())
+
+    def bind(self, queue_name, exchange_name):
+        with self.mutex:
+            self.exchanges[exchange_name].add(queue_name)
+
+    def publish(self, exchange_name, queue_name, body, properties, mandatory=False):
+        expiration = getattr(properties, 'expiration', None)
+        expires_at = None if expiration is None else timeit.default_timer() + int(expiration) / 1000.0
+        with self.mutex:
+            queue_names = [queue_name] if exchange_name == '' else sorted(self.exchanges.get(exchange_name, ()))
+            queue_names = [queue_name for queue_name in queue_names if queue_name in self.queues]
+            if not queue_names and mandatory:
+                raise exceptions.UnroutableError(queue_name)
+            for queue_name in queue_names:
+                self.queues[queue_name].append((body, properties, expires_at, False))
+                self._dispatch(queue_name)
+
+    def add_consumer(self, queue_name, consumer):
+        with self.mutex:
+            self.consumers[queue_name].append(consumer)
+            self._dispatch(queue_name)
+
+    def cancel_consumer(self, consumer):
+        with self.mutex:
+            if consumer in self.consumers.get(consumer.queue_name, ()):
+                self.consumers[consumer.queue_name].remove(consumer)
+
+    def requeue(self, consumer, delivery_tag):
+        with self.mutex:
+            message = consumer.unacked.pop(delivery_tag, None)
+            if message is not None and consumer.queue_name in self.queues:
+                self.queues[consumer.queue_name].appendleft(message[:3] + (True,))
+                self._dispatch(consumer.queue_name)
+
+    def remove_consumer(self, consumer):
+        with self.mutex:
+            if not consumer.queue_name in self.queues:
+                return
+            if consumer in self.consumers[consumer.queue_name]:
+                self.consumers[consumer.queue_name].remove(consumer)
+            # The unacknowledged messages are requeued.
+            for message in reversed(list(consumer.unacked.values())):
+                self.queues[consumer.queue_name].appendleft(message[:3] + (True,))
+            consumer.unacked.clear()
+            self._dispatch(consumer.queue_name)
+
+    def ack(self, consumer, delivery_tag, multiple=False):
+        with self.mutex:
+            if multiple:
+                for tag in [tag for tag in consumer.unacked if tag <= delivery_tag]:
+                    del consumer.unacked[tag]
+            else:
+                consumer.unacked.pop(delivery_tag, None)
+            if consumer.queue_name in self.queues:
+                self._dispatch(consumer.queue_name)
+
+    def _drop_expired(self, queue_name):
+        # As with RabbitMQ, only the expired messages at the head of the queue are dropped.
+        messages = self.queues[queue_name]
+        now = timeit.default_timer()
+        while messages and messages[0][2] is not None and messages[0][2] <= now:
+            messages.popleft()
+
+    def _dispatch(self, queue_name):
+        messages = self.queues[queue_name]
+        consumers = self.consumers[queue_name]
+        while messages and consumers:
+            self._drop_expired(queue_name)
+            if not messages:
+                return
+            for i in range(len(consumers)):
+                consumer = consumers[(self.next_consumer[queue_name] + i) % len(consumers)]
+                if consumer.auto_ack or consumer.prefetch_count == 0 or len(consumer.unacked) < consumer.prefetch_count:
+                    self.next_consumer[queue_name] = (self.next_consumer[queue_name] + i + 1) % len(consumers)
+                    consumer.deliver(messages.popleft())
+                    break
+            else:
+                return
+
+
+broker = Broker()
+
+
+class Consumer(object):
+
+    def __init__(self, channel, queue_name, callback, prefetch_count, consumer_tag, auto_ack=False):
+        self.channel = channel
+        self.consumer_tag = consumer_tag
+        self.queue_name = queue_name
+        self.callback = callback
+        self.prefetch_count = prefetch_count
+        self.auto_ack = auto_ack
+        self.unacked = collections.OrderedDict()
+
+    def deliver(self, message):
+        (body, properties, expires_at, redelivered) = message
+        delivery_tag = next(self.channel.delivery_tags)
+        if not self.auto_ack:
+            self.unacked[delivery_tag] = message
+        self.channel.connection.inbox.put((self, Method(delivery_tag=delivery_tag, redelivered=redelivered), properties, body))
+
+
+class BlockingChannel(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.prefetch_count = 0
+        self.consumers = []
+        self.delivery_tags = itertools.count(1)
+
+    def confirm_delivery(self):
+        pass
+
+    def queue_declare(self, queue, durable=False, passive=False, exclusive=False, **kwargs):
+        # Exclusive queues are deleted when their connection is closed.
+        (queue_name, message_count) = broker.declare(queue, passive)
+        if exclusive:
+            self.connection.exclusive_queues.append(queue_name)
+        return QueueDeclareResult(queue_name, message_count)
+
+    def exchange_declare(self, exchange, exchange_type='fanout', **kwargs):
+        broker.declare_exchange(exchange)
+
+    def queue_bind(self, queue, exchange, **kwargs):
+        broker.bind(queue, exchange)
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        broker.publish(exchange, routing_key, body, properties, mandatory)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, **kwargs):
+        consumer = Consumer(self, queue, on_message_callback, self.prefetch_count, "ctag{0}".format(len(self.consumers) + 1), auto_ack)
+        self.consumers.append(consumer)
+        broker.add_consumer(queue, consumer)
+        return consumer.consumer_tag
+
+    def basic_cancel(self, consumer_tag):
+        # As with pika, the messages delivered to the consumer but not yet passed to its callback
+        # are requeued.  The messages already passed to the callback can still be acked.
+        consumer = next(consumer for consumer in self.consumers if consumer.consumer_tag == consumer_tag)
+        broker.cancel_consumer(consumer)
+        kept = []
+        while True:
+            try:
+                delivery = self.connection.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if delivery[0] is consumer:
+                broker.requeue(consumer, delivery[1].delivery_tag)
+            else:
+                kept.append(delivery)
+        for delivery in kept:
+            self.connection.inbox.put(delivery)
+        return []
+
+    def _find_consumer(self, delivery_tag):
+        for consumer in self.consumers:
+            if delivery_tag in consumer.unacked or any(tag <= delivery_tag for tag in consumer.unacked):
+                return consumer
+        return None
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        consumer = self._find_consumer(delivery_tag)
+        if consumer is not None:
+            broker.ack(consumer, delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        consumer = self._find_consumer(delivery_tag)
+        if consumer is None:
+            return
+        if not requeue:
+            broker.ack(consumer, delivery_tag, multiple)
+            return
+        tags = [tag for tag in consumer.unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        for tag in reversed(tags):
+            broker.requeue(consumer, tag)
+
+    def start_consuming(self):
+        while self.connection.is_open:
+            self.connection.process_data_events(time_limit=None)
+
+    def close(self):
+        for consumer in self.consumers:
+            broker.remove_consumer(consumer)
+        self.consumers = []
+
+
+class BlockingConnection(object):
+
+    # Deliveries are queued to the connection and the callbacks are called by the thread
+    # that calls process_data_events, as with pika.
+    def __init__(self, parameters=None):
+        self.parameters = parameters
+        self.inbox = queue.Queue()
+        self.channels = []
+        self.exclusive_queues = []
+        self.is_open = True
+
+    def channel(self):
+        channel = BlockingChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def process_data_events(self, time_limit=0):
+        # With time_limit=None, wait until at least one message has been delivered.
+        deadline = None if time_limit is None else timeit.default_timer() + time_limit
+        block = True
+        while True:
+            try:
+                if block and deadline is None:
+                    (consumer, method, properties, body) = self.inbox.get(True)
+                elif block and deadline > timeit.default_timer():
+                    (consumer, method, properties, body) = self.inbox.get(True, max(0, deadline - timeit.default_timer()))
+                else:
+                    (consumer, method, properties, body) = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+            consumer.callback(consumer.channel, method, properties, body)
+            block = False
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+        for queue_name in self.exclusive_queues:
+            broker.delete(queue_name)
+        self.is_open = False
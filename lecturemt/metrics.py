@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""metrics.py: Counters, gauges and latency histograms exported as JSON or in the Prometheus text format."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import bisect
+import http.server
+import socketserver
+import threading
+
+# In seconds.
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+class Counter(object):
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.values = {}
+        self.mutex = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.mutex:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def reset(self):
+        with self.mutex:
+            self.values.clear()
+
+    def to_dict(self):
+        with self.mutex:
+            return {','.join(k) if k else '': v for k, v in self.values.items()}
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} counter".format(self.name)]
+        with self.mutex:
+            for label_values, value in sorted(self.values.items()):
+                lines.append("{0}{1} {2}".format(self.name, _format_labels(self.label_names, label_values), value))
+        return lines
+
+
+class Gauge(object):
+
+    # The value is either set explicitly or computed by a function when the metrics are collected.
+    def __init__(self, name, help, label_names=(), function=None):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.function = function
+        self.values = {}
+        self.mutex = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self.mutex:
+            self.values[label_values] = value
+
+    def reset(self):
+        with self.mutex:
+            self.values.clear()
+
+    def _collect(self):
+        if self.function is not None:
+            return {(): self.function()}
+        with self.mutex:
+            return dict(self.values)
+
+    def to_dict(self):
+        return {','.join(k) if k else '': v for k, v in self._collect().items()}
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} gauge".format(self.name)]
+        for label_values, value in sorted(self._collect().items()):
+            lines.append("{0}{1} {2}".format(self.name, _format_labels(self.label_names, label_values), value))
+        return lines
+
+
+class Histogram(object):
+
+    # Recording a value only costs a bisect and a few additions under a lock.
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}
+        self.mutex = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.mutex:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def reset(self):
+        with self.mutex:
+            self.values.clear()
+
+    def get_totals(self):
+        """Return the number and the sum of the observed values, for all the labels."""
+        with self.mutex:
+            return (sum(v[1] for v in self.values.values()), sum(v[2] for v in self.values.values()))
+
+    def to_dict(self):
+        with self.mutex:
+            values = {k: ([c for c in v[0]], v[1], v[2]) for k, v in self.values.items()}
+        result = {}
+        for label_values, (counts, count, total) in values.items():
+            result[','.join(label_values) if label_values else ''] = {'count': count, 'sum': total,
+                'p50': self._quantile(counts, count, 0.5), 'p95': self._quantile(counts, count, 0.95), 'p99': self._quantile(counts, count, 0.99)}
+        return result
+
+    def _quantile(self, counts, count, q):
+        # Upper bound of the bucket holding the quantile.
+        if count == 0:
+            return None
+        rank = q * count
+        cumulative = 0
+        for i, c in enumerate(counts):
+            cumulative += c
+            if cumulative >= rank:
+                return self.buckets[i] if i < len(self.buckets) else '+Inf'
+        return '+Inf'
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help), "# TYPE {0} histogram".format(self.name)]
+        with self.mutex:
+            values = sorted((k, ([c for c in v[0]], v[1], v[2])) for k, v in self.values.items())
+        for label_values, (counts, count, total) in values:
+            cumulative = 0
+            for bound, c in zip(self.buckets + ['+Inf'], counts):
+                cumulative += c
+                lines.append("{0}_bucket{1} {2}".format(self.name, _format_labels(self.label_names, label_values, ('le', bound)), cumulative))
+            lines.append("{0}_sum{1} {2}".format(self.name, _format_labels(self.label_names, label_values), total))
+            lines.append("{0}_count{1} {2}".format(self.name, _format_labels(self.label_names, label_values), count))
+        return lines
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, label_names=()):
+        return self._register(Counter(name, help, label_names))
+
+    def gauge(self, name, help, label_names=(), function=None):
+        return self._register(Gauge(name, help, label_names, function))
+
+    def histogram(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def _register(self, metric):
+        # Registering the same name again returns the existing metric, so several components
+        # (like the workers of a pool) can share a registry.
+        for registered_metric in self.metrics:
+            if registered_metric.name == metric.name:
+                return registered_metric
+        self.metrics.append(metric)
+        return metric
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def to_dict(self):
+        return {metric.name: metric.to_dict() for metric in self.metrics}
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    # http.server.ThreadingHTTPServer only exists from Python 3.7.
+    daemon_threads = True
+
+
+class MetricsHttpServer(threading.Thread):
+
+    # Serves the metrics in the Prometheus text format on /metrics.
+    def __init__(self, registry, host='', port=0):
+        threading.Thread.__init__(self)
+        self.name = "MetricsHttpServer"
+        self.daemon = True
+
+        class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server_address = self.httpd.server_address
+
+    def run(self):
+        self.httpd.serve_forever()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""notifier.py: Notifies the parties waiting for the completion of translations."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import threading
+
+
+class CompletionNotifier(object):
+
+    # Callbacks can be registered for a translation id or for all the translations of an owner.
+    # They are called with the translation record from the thread that completed it,
+    # so they must return quickly (setting an event, putting in a queue, scheduling a future, etc.).
+    def __init__(self):
+        self.listeners = {}
+        self.owner_listeners = {}
+        self.mutex = threading.Lock()
+
+    def add(self, id, callback):
+        with self.mutex:
+            self.listeners.setdefault(id, []).append(callback)
+
+    def remove(self, id, callback):
+        with self.mutex:
+            callbacks = self.listeners.get(id)
+            if callbacks is not None:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self.listeners[id]
+
+    def add_owner(self, owner, callback):
+        with self.mutex:
+            self.owner_listeners.setdefault(owner, []).append(callback)
+
+    def remove_owner(self, owner, callback):
+        with self.mutex:
+            callbacks = self.owner_listeners.get(owner)
+            if callbacks is not None:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self.owner_listeners[owner]
+
+    def notify(self, translation):
+        with self.mutex:
+            if not self.listeners and not self.owner_listeners:
+                return
+            callbacks = list(self.listeners.get(translation['id'], ())) + list(self.owner_listeners.get(translation['owner'], ()))
+        for callback in callbacks:
+            callback(translation)
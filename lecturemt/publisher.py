@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""publisher.py: Long-lived publisher of translation requests fed by an in-process queue."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import logging
+import queue
+import threading
+import time
+import timeit
+
+log = logging.getLogger("default")
+
+
+class Publisher(threading.Thread):
+
+    # The connection is opened once and kept alive.  Messages are handed over through
+    # an in-process queue so that callers never wait for the broker while holding a lock.
+    # Publisher confirms are enabled so that a message is only dropped from the pending
+    # queue once the broker has acknowledged it.  On any connection error, the publisher
+    # reconnects and retries the message that was being sent.
+    # If latency_histogram is given, the time between the call to publish and the confirmation
+    # of the broker is recorded in it.
+    # Besides the messages sent to a queue, messages can be broadcast to a fanout exchange.
+    # A broadcast message that no queue is bound to is silently dropped.
+    def __init__(self, transport, max_pending=10000, reconnect_delay=1, latency_histogram=None):
+        threading.Thread.__init__(self)
+        self.name = "Publisher"
+        self.daemon = True
+        self.transport = transport
+        self.reconnect_delay = reconnect_delay
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.connection = None
+        self.channel = None
+        self.declared_queues = set()
+        self.declared_exchanges = set()
+        self.latency_histogram = latency_histogram
+
+    def publish(self, queue_name, message, properties=None, expiration=None):
+        """If expiration is given, in seconds, the message is dropped by the broker when it has not been consumed by then."""
+        self.pending.put(('', queue_name, message, properties, expiration, timeit.default_timer()))
+
+    def broadcast(self, exchange_name, message):
+        self.pending.put((exchange_name, '', message, None, None, timeit.default_timer()))
+
+    def _connect(self):
+        self.connection = self.transport.connect()
+        self.channel = self.connection.channel()
+        self.channel.confirm_delivery()
+        self.declared_queues = set()
+        self.declared_exchanges = set()
+
+    def _close(self):
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+        self.channel = None
+
+    def _send(self, exchange_name, queue_name, message, properties, expiration):
+        if self.channel is None:
+            self._connect()
+        if exchange_name != '':
+            if not exchange_name in self.declared_exchanges:
+                self.channel.exchange_declare(exchange=exchange_name, exchange_type='fanout')
+                self.declared_exchanges.add(exchange_name)
+            self.channel.basic_publish(exchange=exchange_name, routing_key='', body=message, properties=self.transport.make_properties())
+            return
+        if not queue_name in self.declared_queues:
+            self.channel.queue_declare(queue=queue_name, durable=True)
+            self.declared_queues.add(queue_name)
+        if properties is None:
+            properties = self.transport.make_properties(expiration)
+        self.channel.basic_publish(exchange='', routing_key=queue_name, body=message, properties=properties, mandatory=True)
+
+    def run(self):
+        while True:
+            (exchange_name, queue_name, message, properties, expiration, start) = self.pending.get(True)
+            while True:
+                try:
+                    self._send(exchange_name, queue_name, message, properties, expiration)
+                    if self.latency_histogram is not None:
+                        self.latency_histogram.observe(timeit.default_timer() - start)
+                    break
+                except self.transport.unroutable_error:
+                    log.error("Message to {0} was returned by the broker. Message dropped.".format(queue_name or exchange_name))
+                    break
+                except Exception as e:
+                    log.error("Publisher error: {0}. Reconnecting in {1} s.".format(e, self.reconnect_delay))
+                    self._close()
+                    time.sleep(self.reconnect_delay)
+            self.pending.task_done()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""record.py: Compact representation of the translations kept by the server."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import datetime
+import sys
+import uuid
+
+FIELDS = ('id', 'owner', 'lang_source', 'lang_target', 'status', 'priority',
+    'text_source', 'text_target', 'date_submission', 'date_processed', 'time_submitted', 'time_expiry',
+    'parent_id', 'index', 'sentence_ids', 'text_targets', 'processed_count',
+    'segment_key', 'revision', 'revision_published', 'revision_translated', 'time_published')
+
+FIELD_SET = frozenset(FIELDS)
+
+
+def pack_id(id):
+    """Return the 16 bytes of a translation id in the canonical uuid form, or the id unchanged otherwise."""
+    if isinstance(id, str) and len(id) == 36:
+        try:
+            packed = uuid.UUID(id)
+        except ValueError:
+            return id
+        if str(packed) == id:
+            return packed.bytes
+    return id
+
+
+def unpack_id(id):
+    if isinstance(id, bytes):
+        return str(uuid.UUID(bytes=id))
+    return id
+
+
+# str(datetime) omits the microseconds when they are 0.
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+
+def pack_date(date):
+    """Dates are kept as epochs.  They are given and returned in the str(datetime) format."""
+    if isinstance(date, str):
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(date, date_format).timestamp()
+            except ValueError:
+                pass
+    return date
+
+
+def unpack_date(date):
+    if isinstance(date, float):
+        return str(datetime.datetime.fromtimestamp(date))
+    return date
+
+
+def intern_str(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+PACKERS = {'id': pack_id, 'parent_id': pack_id, 'date_submission': pack_date, 'date_processed': pack_date,
+    'owner': intern_str, 'lang_source': intern_str, 'lang_target': intern_str, 'status': intern_str, 'priority': intern_str}
+
+UNPACKERS = {'id': unpack_id, 'parent_id': unpack_id, 'date_submission': unpack_date, 'date_processed': unpack_date}
+
+
+class TranslationRecord(object):
+
+    # A translation with the same interface as the dict it replaces (record['status'], record.get('text_target'),
+    # 'parent_id' in record, etc.) but several times smaller: the fields are slots, the ids are kept as 16 bytes,
+    # the dates as epochs and the owners, languages, statuses and priorities are interned, so they are shared
+    # by all the records.  A field that is not set (or set to None) is missing.  The fields that are not
+    # known are kept in a dict.
+    #
+    # Like the dicts before them, the records are never modified once they are in the store:
+    # they are replaced with a modified copy.
+    __slots__ = FIELDS + ('extra',)
+
+    def __getitem__(self, key):
+        if key in FIELD_SET:
+            value = getattr(self, key, None)
+            if value is None:
+                raise KeyError(key)
+            unpack = UNPACKERS.get(key)
+            return value if unpack is None else unpack(value)
+        extra = getattr(self, 'extra', None)
+        if extra is None or not key in extra:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        if key in FIELD_SET:
+            pack = PACKERS.get(key)
+            setattr(self, key, value if pack is None else pack(value))
+            return
+        if getattr(self, 'extra', None) is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __contains__(self, key):
+        if key in FIELD_SET:
+            return getattr(self, key, None) is not None
+        extra = getattr(self, 'extra', None)
+        return extra is not None and key in extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [key for key in FIELDS if getattr(self, key, None) is not None]
+        extra = getattr(self, 'extra', None)
+        if extra is not None:
+            keys.extend(extra.keys())
+        return keys
+
+    def update(self, fields):
+        for (key, value) in fields.items():
+            self[key] = value
+
+    def copy(self):
+        record = TranslationRecord()
+        for key in self.__slots__:
+            value = getattr(self, key, None)
+            if value is not None:
+                setattr(record, key, value)
+        if getattr(record, 'extra', None) is not None:
+            record.extra = dict(record.extra)
+        return record
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    @staticmethod
+    def from_dict(fields):
+        record = TranslationRecord()
+        record.update(fields)
+        return record
+
+    def __getstate__(self):
+        return tuple(getattr(self, key, None) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for (key, value) in zip(self.__slots__, state):
+            if value is not None:
+                setattr(self, key, value)
+
+    def __repr__(self):
+        return "TranslationRecord({0})".format(self.to_dict())
+
+
+def to_json(obj):
+    """default function for json.dumps, to serialize the records."""
+    if isinstance(obj, TranslationRecord):
+        return obj.to_dict()
+    raise TypeError("Object of type {0} is not JSON serializable".format(type(obj).__name__))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""scheduling.py: Priority lanes of the translation requests and fair selection of the work by the translators."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import collections
+
+# Live requests (lecture subtitles, etc.) come first; batch requests use the remaining capacity.
+PRIORITIES = ['live', 'batch']
+
+DEFAULT_WEIGHTS = {'live': 8, 'batch': 1}
+
+
+def request_queue_name(lang_pair, priority='live'):
+    """Live requests keep the original queue name so that older translators still serve them."""
+    if priority == 'live':
+        return 'trans_req_{0}'.format(lang_pair)
+    return 'trans_req_{0}_{1}'.format(lang_pair, priority)
+
+
+def response_queue_name(lang_pair, instance_id=''):
+    """Each instance of the server has its own response queues, when several instances are deployed."""
+    if instance_id:
+        return 'trans_resp_{0}_{1}'.format(lang_pair, instance_id)
+    return 'trans_resp_{0}'.format(lang_pair)
+
+
+def cancel_exchange_name(lang_pair):
+    """Fanout exchange through which the ids of the cancelled translations are broadcast to all the translators of a pair."""
+    return 'trans_cancel_{0}'.format(lang_pair)
+
+
+class PriorityPolicy(object):
+
+    # The priority of a translation is the one given in the request, if any.  Otherwise, it is looked up
+    # in [PriorityByUser] (key: user id) and finally Default from the [Priority] section.
+    # The configured priorities must be in PRIORITIES: the translations of any other priority would be
+    # sent to a queue that no translator consumes.
+    def __init__(self, config, default_priority='live'):
+        self.default_priority = config['Priority'].get('Default', default_priority) if 'Priority' in config else default_priority
+        self.priority_by_user = dict(config['PriorityByUser'].items()) if 'PriorityByUser' in config else {}
+        if not self.default_priority in PRIORITIES:
+            raise ValueError("Unknown priority in the Default key of the [Priority] section: {0}. Expected one of: {1}.".format(self.default_priority, ", ".join(PRIORITIES)))
+        for (user_id, priority) in self.priority_by_user.items():
+            if not priority in PRIORITIES:
+                raise ValueError("Unknown priority for user {0} in the [PriorityByUser] section: {1}. Expected one of: {2}.".format(user_id, priority, ", ".join(PRIORITIES)))
+
+    def get_priority(self, user_id, requested_priority=None):
+        if requested_priority in PRIORITIES:
+            return requested_priority
+        # configparser lowercases the keys.
+        return self.priority_by_user.get(user_id.lower(), self.default_priority)
+
+
+class FairQueue(object):
+
+    # Messages waiting to be translated, grouped by priority lane and, within a lane, by owner.
+    #
+    # The lanes are served by stride scheduling: each message taken from a lane advances its pass
+    # by 1 / weight and the lane with the smallest pass is served next, so with weights 8 and 1,
+    # a busy batch lane gets one message out of nine.  A lane that was empty does not get credit
+    # for the time it was idle.  Within a lane, the owners are served in round-robin so that
+    # a large job of one user does not delay the requests of the others.
+    def __init__(self, weights=DEFAULT_WEIGHTS):
+        self.weights = weights
+        self.lanes = {priority: collections.OrderedDict() for priority in PRIORITIES}
+        self.passes = {priority: 0.0 for priority in PRIORITIES}
+        self.virtual_time = 0.0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def put(self, priority, owner, item):
+        owners = self.lanes[priority]
+        if not owners:
+            self.passes[priority] = max(self.passes[priority], self.virtual_time)
+        owners.setdefault(owner, collections.deque()).append(item)
+        self.count += 1
+
+    def take(self, max_count):
+        items = []
+        while self.count > 0 and len(items) < max_count:
+            priority = min((priority for priority in PRIORITIES if self.lanes[priority]), key=lambda priority: self.passes[priority])
+            owners = self.lanes[priority]
+            (owner, queue) = next(iter(owners.items()))
+            items.append(queue.popleft())
+            if queue:
+                owners.move_to_end(owner)
+            else:
+                del owners[owner]
+            self.count -= 1
+            self.virtual_time = self.passes[priority]
+            self.passes[priority] += 1.0 / self.weights[priority]
+        return items
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""segmenter.py: Clients to communicate with a segmentation server."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import re
+import socket
+import subprocess
+import threading
+
+
+class SegmenterFactory:
+
+    @staticmethod
+    def create(class_name, host='localhost', port=16302, command='', logger=None, **kwargs):
+        segmenter = globals()[class_name](host=host, port=port, command=command, logger=logger, **kwargs)
+        return segmenter
+
+
+class Segmenter():
+
+    def segment(self, text):
+        return text
+
+    def segment_batch(self, texts):
+        return [self.segment(text) for text in texts]
+
+    def close(self):
+        pass
+
+
+class NoSegmenter(Segmenter):
+
+    def __init__(self, host='localhost', port=16302, command='', logger=None):
+        pass
+
+
+class CommandSegmenter(Segmenter):
+
+    # Runs the shell command for every sentence.  In the command, TEXT, HOST and PORT
+    # are replaced by the text to segment and the address of the segmentation server.
+    # The text is expected to be enclosed in single quotes in the command, like: echo 'TEXT' | ...
+    def __init__(self, host='localhost', port=16302, command='', logger=None):
+        self.host = host
+        self.port = port
+        self.command = command
+        self.logger = logger
+
+    def segment(self, text):
+        quoted_text = text.replace("'", "'\\''")
+        segmenter_cmd = re.sub(r'TEXT', lambda m: quoted_text, self.command)
+        segmenter_cmd = re.sub(r'HOST', lambda m: self.host, segmenter_cmd)
+        segmenter_cmd = re.sub(r'PORT', lambda m: str(self.port), segmenter_cmd)
+        self.logger.debug("cmd={0}".format(segmenter_cmd))
+
+        segmenter_output = subprocess.check_output(segmenter_cmd, shell=True, universal_newlines=True)
+        segmenter_output = segmenter_output.strip()
+        self.logger.debug("segmenter_output={0}".format(segmenter_output))
+        return segmenter_output
+
+
+class SocketSegmenter(Segmenter):
+
+    # Talks directly to the segmentation server, without any shell or subprocess.
+    #
+    # When persistent is False, a connection is opened for each sentence, the sentence is sent,
+    # the writing side is shut down and the response is read until the server closes the connection.
+    # This is what CommandClient.py does.
+    #
+    # When persistent is True, the connection is kept open and the server is expected to
+    # answer each line with one line.  Several sentences are then pipelined: they are all sent
+    # before the responses are read back in the same order.
+    def __init__(self, host='localhost', port=16302, command='', logger=None, persistent=True, buffer_size=32768, timeout=30):
+        self.host = host
+        self.port = int(port)
+        self.logger = logger
+        self.persistent = persistent
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.mutex = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _segment_once(self, text):
+        sock = self._connect()
+        try:
+            sock.sendall(text.encode('utf-8'))
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                data = sock.recv(self.buffer_size)
+                if not data:
+                    break
+                chunks.append(data)
+        finally:
+            sock.close()
+        return b''.join(chunks).decode('utf-8').strip()
+
+    def _segment_pipelined(self, texts):
+        if self.sock is None:
+            self.sock = self._connect()
+            self.reader = self.sock.makefile('rb')
+        # Newlines would break the framing so they are replaced by spaces.
+        request = ''.join(text.replace('\n', ' ').replace('\r', ' ') + '\n' for text in texts)
+        self.sock.sendall(request.encode('utf-8'))
+        outputs = []
+        for text in texts:
+            line = self.reader.readline()
+            if not line:
+                raise ConnectionError("Segmentation server closed the connection.")
+            outputs.append(line.decode('utf-8').strip())
+        return outputs
+
+    def segment(self, text):
+        return self.segment_batch([text])[0]
+
+    def segment_batch(self, texts):
+        if not self.persistent:
+            return [self._segment_once(text) for text in texts]
+
+        with self.mutex:
+            for attempt in range(0, 2):
+                try:
+                    outputs = self._segment_pipelined(texts)
+                    self.logger.debug("segmenter_outputs={0}".format(outputs))
+                    return outputs
+                except (OSError, ConnectionError):
+                    self.close()
+                    if attempt == 1:
+                        raise
@@ -7,123 +7,450 @@ __version__ = "1.0"
 __email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
 __status__ = "Development"
 
+import asyncio
+import concurrent.futures
 import configparser
-import datetime
 import json
 import logging
 import logging.config
-import pika
+import queue
 from random import randint
 import re
 import socket
 import socketserver
+import struct
 import sys
 import threading
 import time
 import timeit
 import uuid
 
+from expiration import ExpirationIndex, ExpirationPolicy
+from metrics import MetricsHttpServer, MetricsRegistry
+from notifier import CompletionNotifier
+from publisher import Publisher
+from cluster import Placement, get_servers
+from scheduling import PRIORITIES, PriorityPolicy, cancel_exchange_name, request_queue_name, response_queue_name
+from record import TranslationRecord, pack_id, to_json
+from store import TranslationStoreFactory
+from transport import TransportFactory
+
 BUFFER_SIZE = 4096
 
 EOM = "==== EOM ===="
 
+# Requests are either terminated by EOM, in which case the connection serves a single request,
+# or sent as frames made of a 4-byte big-endian length followed by the UTF-8 JSON payload,
+# in which case the connection stays open for the next requests.
+# Both modes are told apart by the first byte: a JSON request always starts with '{'
+# while a frame header would need a size of at least 2 GB to start with that byte.
+FRAME_HEADER = struct.Struct('>I')
+
+# A connection starting with this byte is multiplexed: each frame is made of a 4-byte length,
+# a 4-byte request id and the payload.  Several requests can be in flight at the same time
+# on such a connection; they are processed concurrently and each response frame carries the id
+# of its request, so responses can come back in any order.
+MULTIPLEXED_MODE = b'M'
+MULTIPLEXED_FRAME_HEADER = struct.Struct('>II')
+
+# Maximum number of requests being processed at the same time for a multiplexed connection.
+MAX_IN_FLIGHT = 64
+
+MAX_MESSAGE_SIZE = 1048576
+
+# A sentence ends with a Japanese or western end-of-sentence punctuation, or with a line break.
+# A period only ends a sentence when it is followed by a space, so that numbers like 3.14 are kept.
+# The pattern consumes the sentences themselves: re.split() ignores empty matches before Python 3.7.
+SENTENCE = re.compile(r'(?:[^。！？!?.\n]|\.(?!\s))+[。！？!?]*\.?|[。！？!?]+')
+
+# Languages that do not put spaces between sentences.
+LANGUAGES_WITHOUT_SPACES = ['ja', 'zh']
+
 log = None
  
 logging.basicConfig()
 
 
+def split_sentences(text):
+    """
+    >>> split_sentences('これはペンです。あれは本です。')
+    ['これはペンです。', 'あれは本です。']
+    """
+    return [sentence.strip() for sentence in SENTENCE.findall(text) if sentence.strip()]
+
+
 class TranslationCleaner(threading.Thread):
 
-    # Every 5 minutes (or 3000 secs), check if some translations have been there for too long (more than 10 minutes (or 6000 secs)). 
-    def __init__(self, manager, delay=300, expiration_delay=600):
+    # Every second (by default), remove the translations whose time-to-live has elapsed.
+    # Only the due translations are looked at, thanks to the expiration index of the manager.
+    def __init__(self, manager, delay=1):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.manager = manager
+        self.delay = delay
+
+    def run(self):
+        while True:
+            time.sleep(self.delay)
+            self.manager.remove_expired_translations()
+
+
+class QueueDepthMonitor(threading.Thread):
+
+    # Every few seconds, read the number of messages waiting in the request and response queues.
+    def __init__(self, manager, lang_pairs, delay=5):
         threading.Thread.__init__(self)
+        self.name = "QueueDepthMonitor"
+        self.daemon = True
         self.manager = manager
+        self.queue_names = [request_queue_name(lang_pair, priority) for lang_pair in lang_pairs for priority in PRIORITIES] + [manager.get_response_queue_name(lang_pair) for lang_pair in lang_pairs]
         self.delay = delay
-        self.expiration_delay = expiration_delay
+        self.connection = None
 
     def run(self):
         while True:
+            try:
+                if self.connection is None or not self.connection.is_open:
+                    self.close_connection()
+                    self.connection = self.manager.transport.connect()
+                    channel = self.connection.channel()
+                for queue_name in self.queue_names:
+                    # A queue that does not exist yet closes the channel, so the other queues are read on a new one.
+                    try:
+                        result = channel.queue_declare(queue=queue_name, durable=True, passive=True)
+                    except self.manager.transport.channel_closed_error as e:
+                        log.debug("Cannot read the depth of {0}: {1}".format(queue_name, e))
+                        channel = self.connection.channel()
+                        continue
+                    self.manager.queue_depth.set(result.method.message_count, queue_name)
+            except Exception as e:
+                log.debug("Cannot read the queue depths: {0}".format(e))
+                self.close_connection()
             time.sleep(self.delay)
-            self.manager.remove_expired_translations(self.expiration_delay)
+
+    def close_connection(self):
+        # The connection is kept between the reads.  After an error, it is closed and reopened at the next read.
+        try:
+            if self.connection is not None:
+                self.connection.close()
+        except Exception as e:
+            log.debug("Cannot close the connection: {0}".format(e))
+        finally:
+            self.connection = None
 
 
 class Worker(threading.Thread):
 
-    def __init__(self, name, lang_pair, rabbitmq_host, rabbitmq_port, rabbitmq_username, rabbitmq_password, manager):
+    # Consumes the translation responses of a language pair.  Several workers can consume the responses
+    # of the same pair.  The responses are handled in batches: the consumer callback only collects them,
+    # then all the responses received so far (at most max_batch_size) are applied to the store together,
+    # and acked with a single multiple ack.  No time is spent waiting for a batch to fill up.
+    def __init__(self, name, lang_pair, transport, manager, prefetch_count=100, max_batch_size=100):
         threading.Thread.__init__(self)
         self.name = name
+        self.daemon = True
         self.lang_pair = lang_pair
-        self.rabbitmq_host = rabbitmq_host
-        self.rabbitmq_port = rabbitmq_port
-        self.rabbitmq_username = rabbitmq_username
-        self.rabbitmq_password = rabbitmq_password
+        self.transport = transport
         self.manager = manager
-        log.debug("Creating worker: name={0} lang_pair={1}".format(name, lang_pair))
+        self.prefetch_count = prefetch_count
+        self.max_batch_size = max_batch_size
+        log.debug("Creating worker: name={0} lang_pair={1} prefetch_count={2} max_batch_size={3}".format(name, lang_pair, prefetch_count, max_batch_size))
+
+    def process_translation_responses(self, channel, messages):
+        start = timeit.default_timer()
+        responses = []
+        for (method, body) in messages:
+            try:
+                trans_resp = json.loads(body)
+                responses.append((trans_resp['id'], trans_resp['translated_text'], trans_resp.get('revision')))
+            except:
+                log.debug("Invalid translation response ignored: {0}".format(body))
+        self.manager.update_text_translations(responses)
+        # With a durable store, the responses are acked only once the translations have been saved.
+        # If they cannot be saved, they are still acked: the translations are kept in memory.
+        if not self.manager.translations.sync():
+            log.warning("{0} translation response(s) processed by {1} but not saved.".format(len(messages), self.name))
+        channel.basic_ack(delivery_tag = messages[-1][0].delivery_tag, multiple=True)
+        self.manager.response_latency.observe(timeit.default_timer() - start, self.lang_pair)
+        self.manager.response_batch_size.observe(len(messages), self.lang_pair)
+        log.debug("{0} translation response(s) processed by {1}.".format(len(messages), self.name))
 
     def run(self):
-        credentials = pika.PlainCredentials(self.rabbitmq_username, self.rabbitmq_password)
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.rabbitmq_host, port=self.rabbitmq_port, credentials=credentials))
+        connection = self.transport.connect()
         channel = connection.channel()
 
-        queue_name = 'trans_resp_{0}'.format(self.lang_pair)
+        queue_name = self.manager.get_response_queue_name(self.lang_pair)
         channel.queue_declare(queue=queue_name, durable=True)
 
-        def process_translation_response(ch, method, properties, body):
-            trans_resp = json.loads(body)
-            self.manager.update_text_translation(trans_resp['id'], trans_resp['translated_text'])
-            ch.basic_ack(delivery_tag = method.delivery_tag)
-            log.debug("Translation request {0} has been processed.".format(trans_resp['id']))
+        pending = []
+        def collect_translation_response(ch, method, properties, body):
+            pending.append((method, body))
 
-        channel.basic_qos(prefetch_count=1)
-        channel.basic_consume(queue_name, process_translation_response)
+        channel.basic_qos(prefetch_count=self.prefetch_count)
+        channel.basic_consume(queue_name, collect_translation_response)
 
-        channel.start_consuming()
+        while True:
+            while not pending:
+                connection.process_data_events(time_limit=1)
+            # Take the responses that are already there, without waiting.
+            count = 0
+            while count != len(pending) and len(pending) < self.max_batch_size:
+                count = len(pending)
+                connection.process_data_events(time_limit=0)
+            messages = pending[:self.max_batch_size]
+            del pending[:self.max_batch_size]
+            self.process_translation_responses(channel, messages)
 
 class Manager(object):
 
     def __init__(self, config):
         self.config = config
-        self.translations = {}
+        self.translations = TranslationStoreFactory.create(self.config)
         self.workers = []
-        self.mutex = threading.Lock()
+        self.expiration_policy = ExpirationPolicy(self.config)
+        self.expiration_index = ExpirationIndex()
+        self.priority_policy = PriorityPolicy(self.config)
+        # Stream segments by (owner, segment key).
+        self.segments = {}
+        self.segments_mutex = threading.Lock()
+        self.segment_resend_delay = float(self.config['Server'].get('SegmentResendDelay', 5))
+
+        # When several instances of the server are deployed, each one has an id listed in the [Cluster] section.
+        # It only keeps the translations of the users placed on it and consumes the responses from its own queues.
+        self.instance_id = self.config['Server'].get('InstanceId', '')
+        servers = get_servers(self.config)
+        self.placement = None
+        if servers:
+            if not self.instance_id in servers:
+                raise ValueError("InstanceId {0} is not listed in the Servers of the [Cluster] section.".format(self.instance_id))
+            self.placement = Placement(list(servers.keys()))
+        self.restore_indexes()
+        self.notifier = CompletionNotifier()
+        self.max_wait = float(self.config['Server'].get('MaxWait', 60))
+
+        self.metrics = MetricsRegistry()
+        self.request_latency = self.metrics.histogram('lecturemt_server_request_seconds', 'Time to process a request received on the server socket.', ('action',))
+        self.publish_latency = self.metrics.histogram('lecturemt_server_publish_seconds', 'Time between the submission of a translation request and its confirmation by the broker.')
+        self.response_latency = self.metrics.histogram('lecturemt_server_response_seconds', 'Time to process a batch of translation responses.', ('lang_pair',))
+        self.response_batch_size = self.metrics.histogram('lecturemt_server_response_batch_size', 'Number of translation responses per batch.', ('lang_pair',), buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.translation_latency = self.metrics.histogram('lecturemt_server_translation_seconds', 'Time between the submission and the completion of a translation.', ('lang_pair',))
+        self.submitted_translations = self.metrics.counter('lecturemt_server_submitted_translations_total', 'Number of submitted translations.', ('lang_pair', 'priority'))
+        self.processed_translations = self.metrics.counter('lecturemt_server_processed_translations_total', 'Number of processed translations.', ('lang_pair',))
+        self.metrics.gauge('lecturemt_server_store_size', 'Number of translations kept by the server.', function=lambda: len(self.translations))
+        self.metrics.gauge('lecturemt_server_publisher_pending', 'Number of messages waiting to be published.', function=lambda: self.publisher.pending.qsize())
+        self.queue_depth = self.metrics.gauge('lecturemt_queue_depth', 'Number of messages waiting in a queue.', ('queue',))
+
+        self.transport = TransportFactory.create(self.config)
+        max_pending = int(self.config['RabbitMQ'].get('PublisherMaxPending', 10000)) if 'RabbitMQ' in self.config else 10000
+        self.publisher = Publisher(self.transport, max_pending=max_pending,
+            latency_histogram=self.publish_latency)
+        self.publisher.start()
        
         lang_pairs = self.config['Server']['LanguagePairs'].split(',')
+        response_consumers = int(self.config['Server'].get('ResponseConsumers', 1))
+        response_prefetch_count = int(self.config['Server'].get('ResponsePrefetchCount', 100))
+        response_batch_size = int(self.config['Server'].get('ResponseBatchSize', 100))
         for lang_pair in lang_pairs:
-            worker_name = "Handler_{0}".format(lang_pair)
-            worker = Worker(worker_name, lang_pair, 
-                self.config['RabbitMQ']['Host'], self.config['RabbitMQ']['Port'],
-                self.config['RabbitMQ']['Username'], self.config['RabbitMQ']['Password'], self)
-            self.workers.append(worker)
-            worker.start()
-
-        self.translation_cleaner = TranslationCleaner(self)
+            for i in range(0, response_consumers):
+                worker_name = "Handler_{0}".format(lang_pair) if response_consumers == 1 else "Handler_{0}_{1}".format(lang_pair, i + 1)
+                worker = Worker(worker_name, lang_pair, self.transport, self, prefetch_count=response_prefetch_count, max_batch_size=response_batch_size)
+                self.workers.append(worker)
+                worker.start()
+
+        # With the local transport, the translators run in this process.
+        self.translators = []
+        if 'Transport' in self.config and self.config['Transport'].get('Translators', ''):
+            import translator
+            translator.log = log
+            for worker_config_file in self.config['Transport']['Translators'].split(','):
+                worker_config = configparser.ConfigParser()
+                worker_config.read(worker_config_file.strip())
+                translation_worker = translator.create_worker(worker_config, self.transport)
+                translation_worker.start()
+                self.translators.append(translation_worker)
+
+        cleaner_delay = float(self.config['Expiration'].get('CleanerDelay', 1)) if 'Expiration' in self.config else 1
+        self.translation_cleaner = TranslationCleaner(self, delay=cleaner_delay)
         self.translation_cleaner.start()
 
+        if 'Metrics' in self.config:
+            self.queue_depth_monitor = QueueDepthMonitor(self, lang_pairs, delay=float(self.config['Metrics'].get('QueueDepthDelay', 5)))
+            self.queue_depth_monitor.start()
+            if 'Port' in self.config['Metrics']:
+                self.metrics_server = MetricsHttpServer(self.metrics, self.config['Metrics'].get('Host', ''), int(self.config['Metrics']['Port']))
+                self.metrics_server.start()
+
+    def restore_indexes(self):
+        """Rebuild the expiration index and the stream segments from the translations loaded by a durable store."""
+        for translation in self.translations.values():
+            if 'time_expiry' in translation:
+                self.expiration_index.push(pack_id(translation['id']), translation['time_expiry'])
+            if 'segment_key' in translation:
+                self.segments[(translation['owner'], translation['segment_key'])] = translation['id']
+
     def get_translations(self, user_id):
         if user_id == "admin":
-            self.mutex.acquire()
-            translations = {k : {"status": v["status"], "owner": v["owner"]} for k, v in self.translations.items()}
-            self.mutex.release()
-            return translations 
+            return {t["id"] : {"status": t["status"], "owner": t["owner"]} for t in self.translations.values()}
+
+        # The sentences of a document are not listed; they can be found from the document.
+        return {t["id"] : t["status"] for t in self.translations.get_by_owner(user_id) if not 'parent_id' in t}
+
+    def get_translations_page(self, user_id, cursor=None, limit=100):
+        if user_id != "admin":
+            return {"translations": self.get_translations(user_id), "next_cursor": None}
+
+        translations, next_cursor = self.translations.get_page(cursor, limit)
+        return {"translations": {t["id"] : {"status": t["status"], "owner": t["owner"]} for t in translations}, "next_cursor": next_cursor}
+
+    def new_translation_id(self):
+        if self.placement is not None:
+            return self.placement.new_translation_id(self.instance_id)
+        return str(uuid.uuid4())
+
+    def get_response_queue_name(self, lang_pair):
+        return response_queue_name(lang_pair, self.instance_id)
 
-        self.mutex.acquire()
-        translations = {k : v["status"] for k, v in self.translations.items() if v['owner'] == user_id}
-        self.mutex.release()
-        return translations 
+    def publish_request(self, lang_pair, translation, expiration):
+        """Send the translation to the translators, which reply to the response queue of this instance."""
+        message = translation.to_dict()
+        message['reply_to'] = self.get_response_queue_name(lang_pair)
+        self.publisher.publish(request_queue_name(lang_pair, translation['priority']), json.dumps(message), expiration=expiration)
 
     def update_status_translation(self, id, status):
-        self.mutex.acquire()
-        if id in self.translations:
-            self.translations[id]['status'] = status
-        self.mutex.release()
-
-    def update_text_translation(self, id, text):
-        self.mutex.acquire()
-        if id in self.translations:
-            self.translations[id]['text_target'] = text
-            self.translations[id]['date_processed'] = str(datetime.datetime.now())
-            self.translations[id]['status'] = 'PROCESSED'
-        self.mutex.release()
+        self.translations.update(id, status=status)
+
+    def update_text_translation(self, id, text, revision=None):
+        self.update_text_translations([(id, text, revision)])
+
+    def update_text_translations(self, responses):
+        """
+        Store the translated texts of a batch of (id, text, revision) responses.  The translations are updated
+        with a single acquisition of the lock of each stripe of the store.
+        """
+        now = time.time()
+        updates = []
+        for (id, text, revision) in responses:
+            if revision is not None:
+                self._update_segment(id, text, revision)
+            else:
+                updates.append((id, text))
+
+        def make_update(text):
+            def update(translation):
+                translation['text_target'] = text
+                translation['date_processed'] = now
+                translation['status'] = 'PROCESSED'
+            return update
+
+        translations = self.translations.update_many([(id, make_update(text)) for (id, text) in updates])
+        for (translation, (id, text)) in zip(translations, updates):
+            if translation is None:
+                continue
+            lang_pair = "{0}-{1}".format(translation['lang_source'], translation['lang_target'])
+            self.processed_translations.inc(lang_pair)
+            self.translation_latency.observe(now - translation['time_submitted'], lang_pair)
+            self.notifier.notify(translation)
+            if 'parent_id' in translation:
+                self._update_document(translation['parent_id'], translation['index'], text)
+
+    def _update_document(self, parent_id, index, text):
+        def update(document):
+            if document['text_targets'][index] is not None:
+                return
+            document['text_targets'] = list(document['text_targets'])
+            document['text_targets'][index] = text
+            document['processed_count'] += 1
+            if document['processed_count'] == len(document['text_targets']):
+                separator = '' if document['lang_target'] in LANGUAGES_WITHOUT_SPACES else ' '
+                document['text_target'] = separator.join(document['text_targets'])
+                document['date_processed'] = time.time()
+                document['status'] = 'PROCESSED'
+
+        document = self.translations.update_with(parent_id, update)
+        if document is not None and document['status'] == 'PROCESSED':
+            self.notifier.notify(document)
+
+    def _update_segment(self, id, text, revision):
+        now = time.time()
+        outcome = {'processed': False, 'publish': False}
+        def update(segment):
+            # A translation of an older revision than the one shown is of no use.
+            if revision < segment.get('revision_translated', -1):
+                return
+            segment['text_target'] = text
+            segment['revision_translated'] = revision
+            segment['date_processed'] = time.time()
+            if revision == segment['revision']:
+                segment['status'] = 'PROCESSED'
+                outcome['processed'] = True
+            elif segment['revision_published'] <= revision:
+                # The latest revision was held back while this one was being translated.
+                segment['revision_published'] = segment['revision']
+                segment['time_published'] = now
+                outcome['publish'] = True
+
+        segment = self.translations.update_with(id, update)
+        if segment is None:
+            return
+        lang_pair = "{0}-{1}".format(segment['lang_source'], segment['lang_target'])
+        if outcome['processed']:
+            self.processed_translations.inc(lang_pair)
+            self.translation_latency.observe(now - segment['time_submitted'], lang_pair)
+            self.notifier.notify(segment)
+        if outcome['publish']:
+            self.publish_request(lang_pair, segment, segment['time_expiry'] - now)
+
+    def add_segment(self, translation):
+        """
+        Add or revise a stream segment, like a partial speech recognition hypothesis, identified by its segment_key.
+        All the revisions of a segment share the same translation whose text_target is replaced by the translation
+        of each newer revision.  At most one revision of a segment is waiting in the queues at any time: a revision
+        submitted while another one is being translated is held back, and replaced by any newer revision, until
+        the translation of the previous one comes back (or until SegmentResendDelay seconds have passed).
+        """
+        lang_pair = "{0}-{1}".format(translation['lang_source'], translation['lang_target'])
+        if not lang_pair in self.config['Server']['LanguagePairs'].split(","):
+            return {}
+
+        key = (translation['owner'], translation['segment_key'])
+        with self.segments_mutex:
+            segment_id = self.segments.get(key)
+            if segment_id is None or self.translations.get(segment_id) is None:
+                translation['revision'] = 0
+                translation['revision_published'] = 0
+                translation['time_published'] = time.time()
+                self.segments[key] = translation['id']
+                return self.add_translation(translation)
+
+            now = time.time()
+            # Each revision gives the segment a new lifetime, so that it does not expire while it is still being revised.
+            time_expiry = now + self.expiration_policy.get_ttl(translation['owner'], lang_pair)
+            outcome = {'publish': False}
+            def update(segment):
+                segment['text_source'] = translation['text_source']
+                segment['date_submission'] = translation['date_submission']
+                segment['time_submitted'] = now
+                segment['time_expiry'] = time_expiry
+                segment['revision'] += 1
+                segment['status'] = 'PENDING'
+                in_flight = segment['revision_published'] > segment.get('revision_translated', -1)
+                if not in_flight or now - segment['time_published'] > self.segment_resend_delay:
+                    segment['revision_published'] = segment['revision']
+                    segment['time_published'] = now
+                    outcome['publish'] = True
+            segment = self.translations.update_with(segment_id, update)
+            # The previous entry of the segment in the index is ignored when it becomes due.
+            self.expiration_index.push(pack_id(segment_id), time_expiry)
+
+        if outcome['publish']:
+            self.publish_request(lang_pair, segment, segment['time_expiry'] - now)
+        return segment
+
+    def _forget_segment(self, translation):
+        with self.segments_mutex:
+            key = (translation['owner'], translation['segment_key'])
+            if self.segments.get(key) == translation['id']:
+                del self.segments[key]
 
     def add_translation(self, translation):
         lang_pair = "{0}-{1}".format(translation['lang_source'], translation['lang_target'])
@@ -132,75 +459,345 @@ class Manager(object):
         if not lang_pair in self.config['Server']['LanguagePairs'].split(","):
             return {}
 
-        self.mutex.acquire()
-        try:
-            translation['status'] = "PENDING"
-            self.translations[translation['id']] = translation
+        translation['status'] = "PENDING"
+        translation['priority'] = self.priority_policy.get_priority(translation['owner'], translation.get('priority'))
+        # Epoch of the submission; also used by the translators to measure the time spent in the queue.
+        translation['time_submitted'] = time.time()
+        ttl = self.expiration_policy.get_ttl(translation['owner'], lang_pair)
+        # The translators skip the requests that have expired before their turn comes.
+        translation['time_expiry'] = translation['time_submitted'] + ttl
+        self.translations.add(translation)
+        self.expiration_index.push(pack_id(translation['id']), translation['time_expiry'])
+        self.submitted_translations.inc(lang_pair, translation['priority'])
 
-            # For now, I assume that the translation is a single sentence.
-            # For example, a client application could split the text in several sentences and
-            # submit each sentence using the REST API.
-            # Otherwise, we need to split the text here in several sentences and
-            # associate the subtranslation (for a sentence) to the parent translation (the whole text).
+        # The translation is assumed to be a single sentence.
+        # Texts made of several sentences are submitted with add_document.
 
-            credentials = pika.PlainCredentials(self.config['RabbitMQ']['Username'], self.config['RabbitMQ']['Password'])
-            connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.config['RabbitMQ']['Host'], port=self.config['RabbitMQ']['Port'], credentials=credentials))
-            channel = connection.channel()
+        # The message is handed over to the publisher thread which keeps a persistent
+        # connection to the broker so that no network I/O is done here.
+        # The broker drops the message if it is still queued when the translation expires.
+        self.publish_request(lang_pair, translation, ttl)
 
-            queue_name = 'trans_req_{0}'.format(lang_pair)
-            channel.queue_declare(queue=queue_name, durable=True)
+        return translation
 
-            message = json.dumps(translation)
-            channel.basic_publish(exchange='', routing_key=queue_name, body=message, 
-                properties=pika.BasicProperties( delivery_mode = 2, # make message persistent
-            ))
-            connection.close() 
+    def add_document(self, document, sentences):
+        """
+        Add a translation made of several sentences.  Each sentence is submitted as its own translation
+        so that all the translators can work on the document in parallel.  The translated sentences are
+        joined, in order, in the text_target of the document when they have all been processed.
+        """
+        lang_pair = "{0}-{1}".format(document['lang_source'], document['lang_target'])
+        if not lang_pair in self.config['Server']['LanguagePairs'].split(",") or not sentences:
+            return {}
 
-            return translation
-        finally:
-            self.mutex.release()
+        document['status'] = "PENDING"
+        document['priority'] = self.priority_policy.get_priority(document['owner'], document.get('priority'))
+        document['time_submitted'] = time.time()
+        document['sentence_ids'] = [self.new_translation_id() for sentence in sentences]
+        document['text_targets'] = [None for sentence in sentences]
+        document['processed_count'] = 0
+        ttl = self.expiration_policy.get_ttl(document['owner'], lang_pair)
+        document['time_expiry'] = document['time_submitted'] + ttl
+        self.translations.add(document)
+        self.expiration_index.push(pack_id(document['id']), document['time_expiry'])
+
+        for (index, (sentence_id, sentence)) in enumerate(zip(document['sentence_ids'], sentences)):
+            translation = TranslationRecord()
+            translation['id'] = sentence_id
+            translation['parent_id'] = document['id']
+            translation['index'] = index
+            translation['owner'] = document['owner']
+            translation['priority'] = document['priority']
+            translation['lang_source'] = document['lang_source']
+            translation['lang_target'] = document['lang_target']
+            translation['text_source'] = sentence
+            translation['date_submission'] = document['date_submission']
+            self.add_translation(translation)
+
+        return document
 
     def get_translation(self, user_id, translation_id):
-        self.mutex.acquire()
-        try:
-            if not translation_id in self.translations:
-                return {}
-            
-            translation = self.translations[translation_id]
+        translation = self.translations.get(translation_id)
+        if translation is None:
+            return {}
 
-            if user_id == "admin":
-                return translation
-            
-            return translation if translation['owner'] == user_id else {}
-        finally:
-            self.mutex.release()
+        if user_id == "admin":
+            return translation
+
+        return translation if translation['owner'] == user_id else {}
 
     def remove_translation(self, user_id, translation_id):
-        if not translation_id in self.translations:
+        translation = self.translations.remove(translation_id, owner=None if user_id == "admin" else user_id)
+        if translation is None:
             return {}
-        self.mutex.acquire()
+
+        cancelled_ids = [translation['id']] if translation['status'] == 'PENDING' else []
+        for sentence_id in translation.get('sentence_ids', ()):
+            sentence = self.translations.remove(sentence_id)
+            if sentence is not None and sentence['status'] == 'PENDING':
+                cancelled_ids.append(sentence_id)
+        if 'segment_key' in translation:
+            self._forget_segment(translation)
+        if cancelled_ids:
+            self.cancel_translations("{0}-{1}".format(translation['lang_source'], translation['lang_target']), cancelled_ids)
+        return translation
+
+    def cancel_translations(self, lang_pair, ids):
+        """Tell all the translators of the language pair to skip the requests of these translations that they have not processed yet."""
+        self.publisher.broadcast(cancel_exchange_name(lang_pair), json.dumps({'ids': ids}))
+
+    def wait_translation(self, user_id, translation_id, timeout):
+        """Like get_translation but, if the translation is pending, wait at most timeout seconds for its completion."""
+        event = threading.Event()
+        callback = lambda translation: event.set()
+        # The callback is registered before looking at the status so that a completion cannot be missed.
+        self.notifier.add(translation_id, callback)
+        try:
+            translation = self.get_translation(user_id, translation_id)
+            if translation and translation['status'] == 'PENDING':
+                event.wait(min(timeout, self.max_wait))
+                translation = self.get_translation(user_id, translation_id)
+            return translation
+        finally:
+            self.notifier.remove(translation_id, callback)
+
+    async def wait_translation_async(self, user_id, translation_id, timeout):
+        loop = asyncio.get_event_loop()
+        completed = asyncio.Event()
+        callback = lambda translation: loop.call_soon_threadsafe(completed.set)
+        self.notifier.add(translation_id, callback)
         try:
-            translation = self.translations[translation_id]
-            if user_id in ["admin", translation['owner']]:
-                del self.translations[translation_id]
-                return translation
+            translation = self.get_translation(user_id, translation_id)
+            if translation and translation['status'] == 'PENDING':
+                try:
+                    await asyncio.wait_for(completed.wait(), min(timeout, self.max_wait))
+                except asyncio.TimeoutError:
+                    pass
+                translation = self.get_translation(user_id, translation_id)
+            return translation
         finally:
-            self.mutex.release()
+            self.notifier.remove(translation_id, callback)
 
-        return {}
+    def _start_watch(self, user_id, translation_ids, callback):
+        # Return (ids still pending, translations already processed).
+        self.notifier.add_owner(user_id, callback)
+        if translation_ids is None:
+            translations = self.translations.get_by_owner(user_id)
+        else:
+            translations = [self.get_translation(user_id, id) for id in translation_ids]
+        pending = set(t['id'] for t in translations if t and t['status'] == 'PENDING')
+        processed = [t for t in translations if t and t['status'] == 'PROCESSED']
+        return (pending, processed)
 
-    def remove_expired_translations(self, expiration_delay):
-        self.mutex.acquire()
+    def watch_translations(self, user_id, translation_ids, timeout):
+        """
+        Generate the processed translations of the user as they complete, among translation_ids
+        or among all its translations when translation_ids is None.  The last generated item
+        is {"pending": [...]} listing the translations that were still pending when the timeout hit.
+        """
+        completed = queue.Queue()
+        pending, processed = self._start_watch(user_id, translation_ids, completed.put)
         try:
-            expired_translations = [k for (k,v) in self.translations.items() if self._is_expired(v, expiration_delay)]
-            for trans_id in expired_translations:
-                del self.translations[trans_id]
+            for translation in processed:
+                yield translation
+            deadline = time.time() + min(timeout, self.max_wait)
+            while pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    translation = completed.get(True, remaining)
+                except queue.Empty:
+                    break
+                if translation['id'] in pending:
+                    pending.discard(translation['id'])
+                    yield translation
+            yield {'pending': sorted(pending)}
+        finally:
+            self.notifier.remove_owner(user_id, completed.put)
+
+    async def watch_translations_async(self, user_id, translation_ids, timeout):
+        loop = asyncio.get_event_loop()
+        completed = asyncio.Queue()
+        callback = lambda translation: loop.call_soon_threadsafe(completed.put_nowait, translation)
+        pending, processed = self._start_watch(user_id, translation_ids, callback)
+        try:
+            for translation in processed:
+                yield translation
+            deadline = loop.time() + min(timeout, self.max_wait)
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    translation = await asyncio.wait_for(completed.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if translation['id'] in pending:
+                    pending.discard(translation['id'])
+                    yield translation
+            yield {'pending': sorted(pending)}
         finally:
-            self.mutex.release()
+            self.notifier.remove_owner(user_id, callback)
+
+    def remove_expired_translations(self):
+        start = timeit.default_timer()
+        evictions = 0
+        while True:
+            now = time.time()
+            expired_translations = self.expiration_index.pop_due(now)
+            if not expired_translations:
+                break
+            for trans_id in expired_translations:
+                translation = self.translations.get(trans_id)
+                if translation is not None and 'segment_key' in translation:
+                    # A segment revised since this entry was pushed has a later entry in the index.
+                    # The check and the removal are done under segments_mutex so that a revision cannot come in between.
+                    with self.segments_mutex:
+                        translation = self.translations.get(trans_id)
+                        if translation is None or translation['time_expiry'] > now:
+                            continue
+                        translation = self.translations.remove(trans_id)
+                        if translation is None:
+                            continue
+                        key = (translation['owner'], translation['segment_key'])
+                        if self.segments.get(key) == translation['id']:
+                            del self.segments[key]
+                else:
+                    translation = self.translations.remove(trans_id)
+                if translation is not None:
+                    evictions += 1
+                    for sentence_id in translation.get('sentence_ids', ()):
+                        self.translations.remove(sentence_id)
+        self.expiration_index.record_run(evictions, timeit.default_timer() - start)
+
+    def get_expiration_stats(self):
+        return self.expiration_index.get_stats()
+
+    def parse_request(self, str_data):
+        """Return the request as a dict, or None if it is invalid."""
+        log.debug("Request to server={0}".format(str_data))
+        json_data = None
+        try:
+            json_data = json.loads(str_data)
+        except Exception as e:
+            log.info("Invalid JSON data. Request ignored.")
+            return None
+        if not isinstance(json_data, dict) or not isinstance(json_data.get('action'), str):
+            log.info("Request without action. Request ignored.")
+            return None
+        return json_data
+
+    def validate_request(self, json_data):
+        """Return None if the fields of the request have the expected types, or the reason why they don't."""
+        if not isinstance(json_data, dict) or not isinstance(json_data.get('action'), str):
+            return "no action"
+        for key in ('segment_key', 'priority', 'cursor'):
+            if json_data.get(key) is not None and not isinstance(json_data[key], str):
+                return "{0} must be a string".format(key)
+        if json_data.get('priority') is not None and not json_data['priority'] in PRIORITIES:
+            return "unknown priority"
+        if json_data.get('cursor') and not re.match(r'^\d+:', json_data['cursor']):
+            return "invalid cursor"
+        if 'sentences' in json_data and (not isinstance(json_data['sentences'], list) or not json_data['sentences'] or
+                not all(isinstance(sentence, str) and sentence.strip() for sentence in json_data['sentences'])):
+            return "sentences must be a list of non-empty strings"
+        if 'limit' in json_data:
+            try:
+                if int(json_data['limit']) < 1:
+                    return "limit must be positive"
+            except (TypeError, ValueError):
+                return "limit must be an integer"
+        return None
+
+    def process_request(self, json_data):
+        """
+        Process a parsed request and return the JSON response.
+        The response to an invalid request is {}.  If the request fails, the response is {"error": reason}.
+        """
+        start_request = timeit.default_timer()
+        invalid = self.validate_request(json_data)
+        if invalid is not None:
+            log.info("Invalid request ({0}). Request ignored.".format(invalid))
+            return self.format_response({})
+        try:
+            response = self.dispatch_request(json_data)
+        except Exception as e:
+            log.error("Request {0} failed: {1!r}".format(json_data['action'], e))
+            response = {'error': "{0}: {1}".format(type(e).__name__, e)}
+
+        processing_time = timeit.default_timer() - start_request
+        self.request_latency.observe(processing_time, json_data['action'])
+        log.debug("Request processed in {0} s. by {1}".format(processing_time, threading.current_thread().name))
+        return self.format_response(response)
+
+    def dispatch_request(self, json_data):
+        response = {}
+        if json_data['action'] == 'get_server_version':
+            response = {'server_version': '1.0'}
+        elif json_data['action'] == 'get_server_metrics':
+            response = self.metrics.to_dict()
+        elif json_data['action'] == 'get_server_status':
+            response = {'server_status': 'OK', 'translation_count': len(self.translations), 'expiration': self.get_expiration_stats()}
+        elif json_data['action'] == 'get_translations':
+            log.debug("get_transactions user_id={0}".format(json_data['user_id']))
+            if 'limit' in json_data:
+                response = self.get_translations_page(json_data['user_id'], json_data.get('cursor'), int(json_data['limit']))
+            else:
+                response = self.get_translations(json_data['user_id'])
+        elif json_data['action'] == 'add_translation':
+            log.debug("add_translation user_id={0}".format(json_data['user_id']))
+            log.debug("text_source={0}".format(json_data['text_source']))
+
+            translation = TranslationRecord()
+            translation['id'] = self.new_translation_id()
+            translation['owner'] = json_data['user_id']
+            translation['lang_source'] = json_data['lang_source']
+            translation['lang_target'] = json_data['lang_target']
+            translation['text_source'] = json_data['text_source']
+            translation['date_submission'] = json_data['date_submission']
+            if 'priority' in json_data:
+                translation['priority'] = json_data['priority']
+            
+            if 'segment_key' in json_data:
+                translation['segment_key'] = json_data['segment_key']
+                response = self.add_segment(translation)
+            else:
+                response = self.add_translation(translation)
+        elif json_data['action'] == 'add_document':
+            log.debug("add_document user_id={0}".format(json_data['user_id']))
 
-    def _is_expired(self, translation, expiration_delay):
-        delta = datetime.datetime.now() - datetime.datetime.strptime(translation['date_submission'], '%Y-%m-%d %H:%M:%S.%f')
-        return (delta.seconds > expiration_delay)
+            document = TranslationRecord()
+            document['id'] = self.new_translation_id()
+            document['owner'] = json_data['user_id']
+            document['lang_source'] = json_data['lang_source']
+            document['lang_target'] = json_data['lang_target']
+            if 'sentences' in json_data:
+                sentences = [sentence.strip() for sentence in json_data['sentences'] if sentence.strip()]
+                document['text_source'] = ('' if json_data['lang_source'] in LANGUAGES_WITHOUT_SPACES else ' ').join(sentences)
+            else:
+                sentences = split_sentences(json_data['text_source'])
+                document['text_source'] = json_data['text_source']
+            document['date_submission'] = json_data['date_submission']
+            if 'priority' in json_data:
+                document['priority'] = json_data['priority']
+
+            response = self.add_document(document, sentences)
+        elif json_data['action'] == 'get_translation':
+            log.debug("get_translation user_id={0}".format(json_data['user_id']))
+            response = self.get_translation(json_data['user_id'], json_data['translation_id'])
+        elif json_data['action'] == 'wait_translation':
+            log.debug("wait_translation user_id={0}".format(json_data['user_id']))
+            response = self.wait_translation(json_data['user_id'], json_data['translation_id'], float(json_data.get('timeout', self.max_wait)))
+        elif json_data['action'] == 'remove_translation':
+            log.debug("remove_translation user_id={0}".format(json_data['user_id']))
+            response = self.remove_translation(json_data['user_id'], json_data['translation_id'])
+        return response
+
+    def format_response(self, response):
+        response = json.dumps(response, ensure_ascii=False, default=to_json)
+        log.debug("Response from server={0}".format(response))
+        return response
 
 
 
@@ -217,67 +814,133 @@ class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
                 super(ServerRequestHandler, self).__init__(*args, **kwargs)
 
             def handle(self):
-                start_request = timeit.default_timer()
                 log.debug("Handling request...")
 
-                # Read until EOM delimiter is met. 
-                total_data = []
-                data = ''
+                first_byte = self.request.recv(1)
+                if not first_byte:
+                    return
+
+                if first_byte == b'{' or first_byte.isspace():
+                    str_data = self.read_until_eom(first_byte)
+                    if str_data is None:
+                        return
+                    json_data = self.manager.parse_request(str_data)
+                    if json_data is None:
+                        return
+                    if json_data['action'] == 'watch_translations':
+                        # The translations are sent as they complete, one JSON object per line.
+                        for item in self.manager.watch_translations(json_data['user_id'], json_data.get('translation_ids'), float(json_data.get('timeout', self.manager.max_wait))):
+                            self.request.sendall((self.manager.format_response(item) + '\n').encode('utf-8'))
+                        return
+                    response = self.manager.process_request(json_data)
+                    self.request.sendall(response.encode('utf-8'))
+                    return
+
+                if first_byte == MULTIPLEXED_MODE:
+                    self.serve_multiplexed()
+                    return
+
+                # Framed mode: serve requests until the client closes the connection.
+                header = first_byte
                 while True:
-                    data = self.request.recv(BUFFER_SIZE).decode('utf-8')
-                    if EOM in data:
-                        total_data.append(data[:data.find(EOM)])
-                        break
-                    total_data.append(data)
-                    if len(total_data)>1:
-                        #check if EOM was split
-                        last_pair = total_data[-2] + total_data[-1]
-                        if EOM in last_pair:
-                            total_data[-2] = last_pair[:last_pair.find(EOM)]
-                            total_data.pop()
-                            break
-                str_data = ''.join(total_data)
-
-                log.debug("Request to server={0}".format(str_data))
-                response = {}
-                json_data = None
+                    header += self.read_exactly(FRAME_HEADER.size - len(header))
+                    if len(header) < FRAME_HEADER.size:
+                        return
+                    (size,) = FRAME_HEADER.unpack(header)
+                    if size > MAX_MESSAGE_SIZE:
+                        log.info("Frame too large ({0} bytes). Connection closed.".format(size))
+                        return
+                    data = self.read_exactly(size)
+                    if len(data) < size:
+                        return
+                    json_data = self.manager.parse_request(data.decode('utf-8'))
+                    if json_data is not None and json_data['action'] == 'watch_translations':
+                        # The translations are sent as they complete, one per frame.
+                        for item in self.manager.watch_translations(json_data['user_id'], json_data.get('translation_ids'), float(json_data.get('timeout', self.manager.max_wait))):
+                            self.send_frame(self.manager.format_response(item))
+                    else:
+                        self.send_frame(self.manager.process_request(json_data) if json_data is not None else '{}')
+                    header = b''
+
+            def send_frame(self, response):
+                payload = response.encode('utf-8')
+                self.request.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+            def serve_multiplexed(self):
+                # Each request is processed by its own thread so that a slow request (a wait, for instance)
+                # does not delay the others.  Reading stops while MAX_IN_FLIGHT requests are being processed.
+                write_lock = threading.Lock()
+                in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+                while True:
+                    header = self.read_exactly(MULTIPLEXED_FRAME_HEADER.size)
+                    if len(header) < MULTIPLEXED_FRAME_HEADER.size:
+                        return
+                    (size, request_id) = MULTIPLEXED_FRAME_HEADER.unpack(header)
+                    if size > MAX_MESSAGE_SIZE:
+                        log.info("Frame too large ({0} bytes). Connection closed.".format(size))
+                        return
+                    data = self.read_exactly(size)
+                    if len(data) < size:
+                        return
+                    in_flight.acquire()
+                    thread = threading.Thread(target=self.process_multiplexed_request, args=(data, request_id, write_lock, in_flight))
+                    thread.daemon = True
+                    thread.start()
+
+            def process_multiplexed_request(self, data, request_id, write_lock, in_flight):
                 try:
-                    json_data = json.loads(str_data)
+                    json_data = self.manager.parse_request(data.decode('utf-8'))
+                    if json_data is not None and json_data['action'] == 'watch_translations':
+                        for item in self.manager.watch_translations(json_data['user_id'], json_data.get('translation_ids'), float(json_data.get('timeout', self.manager.max_wait))):
+                            self.send_multiplexed_frame(write_lock, request_id, self.manager.format_response(item))
+                    else:
+                        self.send_multiplexed_frame(write_lock, request_id, self.manager.process_request(json_data) if json_data is not None else '{}')
+                except OSError:
+                    # The client has closed the connection.
+                    pass
                 except Exception as e:
-                    log.info("Invalid JSON data. Request ignored.")
-
-                if json_data:    
-                    if json_data['action'] == 'get_server_version':
-                        response = {'server_version': '1.0'}
-                    elif json_data['action'] == 'get_server_status':
-                        response = {'server_status': 'OK'}
-                    elif json_data['action'] == 'get_translations':
-                        log.debug("get_transactions user_id={0}".format(json_data['user_id']))
-                        response = self.manager.get_translations(json_data['user_id'])
-                    elif json_data['action'] == 'add_translation':
-                        log.debug("add_translation user_id={0}".format(json_data['user_id']))
-                        log.debug("text_source={0}".format(json_data['text_source']))
-
-                        translation = {}
-                        translation['id'] = str(uuid.uuid4())
-                        translation['owner'] = json_data['user_id']
-                        translation['lang_source'] = json_data['lang_source']
-                        translation['lang_target'] = json_data['lang_target']
-                        translation['text_source'] = json_data['text_source']
-                        translation['date_submission'] = json_data['date_submission']
-                        
-                        response = self.manager.add_translation(translation)
-                    elif json_data['action'] == 'get_translation':
-                        log.debug("get_translation user_id={0}".format(json_data['user_id']))
-                        response = self.manager.get_translation(json_data['user_id'], json_data['translation_id'])
-                    elif json_data['action'] == 'remove_translation':
-                        log.debug("remove_translation user_id={0}".format(json_data['user_id']))
-                        response = self.manager.remove_translation(json_data['user_id'], json_data['translation_id'])
-
-                    log.debug("Request processed in {0} s. by {1}".format(timeit.default_timer() - start_request, threading.current_thread().name))
-                    response = json.dumps(response, ensure_ascii=False)
-                    log.debug("Response from server={0}".format(response))
-                    self.request.sendall(response.encode('utf-8'))
+                    # Every request gets a response, otherwise its caller would wait for it until its timeout.
+                    log.error("Multiplexed request {0} failed: {1!r}".format(request_id, e))
+                    try:
+                        self.send_multiplexed_frame(write_lock, request_id, self.manager.format_response({'error': "{0}: {1}".format(type(e).__name__, e)}))
+                    except OSError:
+                        pass
+                finally:
+                    in_flight.release()
+
+            def send_multiplexed_frame(self, write_lock, request_id, response):
+                payload = response.encode('utf-8')
+                with write_lock:
+                    self.request.sendall(MULTIPLEXED_FRAME_HEADER.pack(len(payload), request_id) + payload)
+
+            def read_exactly(self, size):
+                chunks = []
+                while size > 0:
+                    data = self.request.recv(min(size, BUFFER_SIZE))
+                    if not data:
+                        break
+                    chunks.append(data)
+                    size -= len(data)
+                return b''.join(chunks)
+
+            def read_until_eom(self, data):
+                # Read until EOM delimiter is met.  The search is done on the bytes
+                # so that a multi-byte character split between two chunks is not a problem.
+                eom = EOM.encode('utf-8')
+                total_data = bytearray(data)
+                start = 0
+                while True:
+                    pos = total_data.find(eom, start)
+                    if pos != -1:
+                        return total_data[:pos].decode('utf-8')
+                    if len(total_data) > MAX_MESSAGE_SIZE:
+                        log.info("Request too large. Request ignored.")
+                        return None
+                    start = max(0, len(total_data) - len(eom) + 1)
+                    data = self.request.recv(BUFFER_SIZE)
+                    if not data:
+                        return None
+                    total_data += data
 
         return ServerRequestHandler
 
@@ -286,6 +949,158 @@ class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
         handler_class = self.make_request_handler(self.manager)
         socketserver.TCPServer.__init__(self, server_address, handler_class)
 
+class AsyncServer(object):
+
+    # Serves the same requests as Server but with a single thread running an asyncio loop,
+    # so that idle connections only cost a small buffer instead of a thread.
+    # The requests are processed by a pool of AsyncRequestThreads threads: the Manager takes locks,
+    # waits for the durable store and may block when the publisher is busy, which must not stall
+    # the other connections.  Only the waits are done on the event loop.
+    def __init__(self, server_address, config):
+        self.server_address = server_address
+        self.manager = Manager(config)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(config['Server'].get('AsyncRequestThreads', 16)), thread_name_prefix="AsyncRequest")
+        self.server = None
+
+    async def handle_connection(self, reader, writer):
+        try:
+            first_byte = await reader.read(1)
+            if not first_byte:
+                return
+
+            if first_byte == b'{' or first_byte.isspace():
+                try:
+                    data = await reader.readuntil(EOM.encode('utf-8'))
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    log.info("Incomplete or too large request. Request ignored.")
+                    return
+                str_data = (first_byte + data[:-len(EOM.encode('utf-8'))]).decode('utf-8')
+                json_data = self.manager.parse_request(str_data)
+                if json_data is None:
+                    return
+                if json_data['action'] == 'watch_translations':
+                    async for item in self.watch_translations(json_data):
+                        writer.write((item + '\n').encode('utf-8'))
+                        await writer.drain()
+                    return
+                writer.write((await self.process_request(json_data)).encode('utf-8'))
+                await writer.drain()
+                return
+
+            if first_byte == MULTIPLEXED_MODE:
+                await self.serve_multiplexed(reader, writer)
+                return
+
+            header = first_byte
+            while True:
+                try:
+                    header += await reader.readexactly(FRAME_HEADER.size - len(header))
+                    (size,) = FRAME_HEADER.unpack(header)
+                    if size > MAX_MESSAGE_SIZE:
+                        log.info("Frame too large ({0} bytes). Connection closed.".format(size))
+                        return
+                    data = await reader.readexactly(size)
+                except asyncio.IncompleteReadError:
+                    return
+                json_data = self.manager.parse_request(data.decode('utf-8'))
+                if json_data is not None and json_data['action'] == 'watch_translations':
+                    async for item in self.watch_translations(json_data):
+                        await self.send_frame(writer, item)
+                else:
+                    await self.send_frame(writer, await self.process_request(json_data) if json_data is not None else '{}')
+                header = b''
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve_multiplexed(self, reader, writer):
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        tasks = set()
+        try:
+            while True:
+                try:
+                    (size, request_id) = MULTIPLEXED_FRAME_HEADER.unpack(await reader.readexactly(MULTIPLEXED_FRAME_HEADER.size))
+                    if size > MAX_MESSAGE_SIZE:
+                        log.info("Frame too large ({0} bytes). Connection closed.".format(size))
+                        return
+                    data = await reader.readexactly(size)
+                except asyncio.IncompleteReadError:
+                    return
+                await in_flight.acquire()
+                task = asyncio.ensure_future(self.process_multiplexed_request(writer, data, request_id, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in list(tasks):
+                task.cancel()
+
+    async def process_multiplexed_request(self, writer, data, request_id, in_flight):
+        try:
+            json_data = self.manager.parse_request(data.decode('utf-8'))
+            if json_data is not None and json_data['action'] == 'watch_translations':
+                async for item in self.watch_translations(json_data):
+                    await self.send_multiplexed_frame(writer, request_id, item)
+            else:
+                await self.send_multiplexed_frame(writer, request_id, await self.process_request(json_data) if json_data is not None else '{}')
+        except ConnectionError:
+            pass
+        except Exception as e:
+            # Every request gets a response, otherwise its caller would wait for it until its timeout.
+            log.error("Multiplexed request {0} failed: {1!r}".format(request_id, e))
+            try:
+                await self.send_multiplexed_frame(writer, request_id, self.manager.format_response({'error': "{0}: {1}".format(type(e).__name__, e)}))
+            except ConnectionError:
+                pass
+        finally:
+            in_flight.release()
+
+    async def send_multiplexed_frame(self, writer, request_id, response):
+        payload = response.encode('utf-8')
+        # A single write keeps the frame in one piece even when several tasks answer at the same time.
+        writer.write(MULTIPLEXED_FRAME_HEADER.pack(len(payload), request_id) + payload)
+        await writer.drain()
+
+    async def send_frame(self, writer, response):
+        payload = response.encode('utf-8')
+        writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+        await writer.drain()
+
+    async def process_request(self, json_data):
+        # Waiting must not block the event loop, so it is done asynchronously here.
+        if json_data['action'] == 'wait_translation':
+            log.debug("wait_translation user_id={0}".format(json_data['user_id']))
+            translation = await self.manager.wait_translation_async(json_data['user_id'], json_data['translation_id'], float(json_data.get('timeout', self.manager.max_wait)))
+            return self.manager.format_response(translation)
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.manager.process_request, json_data)
+
+    async def watch_translations(self, json_data):
+        log.debug("watch_translations user_id={0}".format(json_data['user_id']))
+        async for item in self.manager.watch_translations_async(json_data['user_id'], json_data.get('translation_ids'), float(json_data.get('timeout', self.manager.max_wait))):
+            yield self.manager.format_response(item)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.server_address[0], self.server_address[1],
+            limit=MAX_MESSAGE_SIZE, reuse_address=True, backlog=1024)
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+
+    def serve_forever(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.start())
+        try:
+            loop.run_forever()
+        finally:
+            self.server.close()
+            loop.run_until_complete(self.server.wait_closed())
+            loop.close()
+
+    def shutdown(self):
+        pass
+
+    def server_close(self):
+        pass
+
 def do_start_server(config_file, log_config):
     if log_config:
         logging.config.fileConfig(log_config)
@@ -294,7 +1109,15 @@ def do_start_server(config_file, log_config):
 
     config = configparser.ConfigParser()
     config.read(config_file)
-    server = Server((config['Server']['Host'], int(config['Server']['Port'])), config)
+
+    global MAX_MESSAGE_SIZE
+    MAX_MESSAGE_SIZE = int(config['Server'].get('MaxMessageSize', MAX_MESSAGE_SIZE))
+
+    server_address = (config['Server']['Host'], int(config['Server']['Port']))
+    if config['Server'].get('Engine', 'threaded') == 'asyncio':
+        server = AsyncServer(server_address, config)
+    else:
+        server = Server(server_address, config)
     ip, port = server.server_address
     log.info("Start listening for requests on {0}:{1}...".format(socket.gethostname(), port))
 
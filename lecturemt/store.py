@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""store.py: Lock-striped in-memory store for the translations kept by the server."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+import bisect
+import threading
+import zlib
+
+from record import pack_id, unpack_id
+
+
+class TranslationStoreFactory:
+
+    @staticmethod
+    def create(config):
+        """
+        Create the store described by the [Store] section of config.ini.  Translations are kept in memory only by default.
+        With Type: Durable, they are also written to the files of Directory so that they survive a restart.
+        """
+        stripe_count = int(config['Server'].get('StoreStripes', 64))
+        store_type = config['Store'].get('Type', 'Memory') if 'Store' in config else 'Memory'
+        if store_type == 'Durable':
+            from durablestore import DurableTranslationStore
+            return DurableTranslationStore(config['Store']['Directory'], stripe_count,
+                snapshot_interval=float(config['Store'].get('SnapshotInterval', 600)),
+                snapshot_log_records=int(config['Store'].get('SnapshotLogRecords', 1000000)))
+        return TranslationStore(stripe_count)
+
+
+class TranslationStore(object):
+
+    # The translations are spread over several stripes, each one protected by its own lock,
+    # so that operations on different translations rarely contend.  A secondary index
+    # maps each owner to the ids of its translations so that listing the translations of a user
+    # only costs the number of items owned by that user.
+    #
+    # Records are never modified in place: an update replaces the record with a modified copy.
+    # This way, readers can fetch a record without taking any lock and always get a consistent view.
+    # The records are kept under their packed id (16 bytes for a uuid).
+    # When both are needed, a record lock is always taken before an owner lock.
+    #
+    # Every change is reported to _on_put or _on_remove while the record is locked, so that
+    # subclasses see the changes of a record in the order they were made.
+    def __init__(self, stripe_count=64):
+        self.stripe_count = stripe_count
+        self.stripes = [{} for i in range(0, stripe_count)]
+        self.locks = [threading.Lock() for i in range(0, stripe_count)]
+        self.owner_stripes = [{} for i in range(0, stripe_count)]
+        self.owner_locks = [threading.Lock() for i in range(0, stripe_count)]
+
+    def _stripe_of(self, key):
+        return zlib.crc32(key if isinstance(key, bytes) else key.encode('utf-8')) % self.stripe_count
+
+    def _on_put(self, translation):
+        pass
+
+    def _on_remove(self, id):
+        pass
+
+    def sync(self):
+        """
+        Return once all the changes made so far are durable, True if they could be saved.
+        There is nothing to wait for in memory.
+        """
+        return True
+
+    def _index_add(self, owner, id):
+        s = self._stripe_of(owner)
+        with self.owner_locks[s]:
+            self.owner_stripes[s].setdefault(owner, set()).add(id)
+
+    def _index_remove(self, owner, id):
+        s = self._stripe_of(owner)
+        with self.owner_locks[s]:
+            ids = self.owner_stripes[s].get(owner)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self.owner_stripes[s][owner]
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self.stripes)
+
+    def __contains__(self, id):
+        id = pack_id(id)
+        return id in self.stripes[self._stripe_of(id)]
+
+    def add(self, translation):
+        id = pack_id(translation['id'])
+        s = self._stripe_of(id)
+        with self.locks[s]:
+            self.stripes[s][id] = translation
+            self._index_add(translation['owner'], id)
+            self._on_put(translation)
+
+    def get(self, id):
+        id = pack_id(id)
+        return self.stripes[self._stripe_of(id)].get(id)
+
+    def update(self, id, **fields):
+        """Replace the record with a copy holding the new field values. Return the new record or None."""
+        id = pack_id(id)
+        s = self._stripe_of(id)
+        with self.locks[s]:
+            translation = self.stripes[s].get(id)
+            if translation is None:
+                return None
+            translation = translation.copy()
+            translation.update(fields)
+            self.stripes[s][id] = translation
+            self._on_put(translation)
+            return translation
+
+    def update_with(self, id, function):
+        """
+        Replace the record with a copy modified by function, which is called with the copy while the record is locked.
+        Return the new record or None.
+        """
+        id = pack_id(id)
+        s = self._stripe_of(id)
+        with self.locks[s]:
+            translation = self.stripes[s].get(id)
+            if translation is None:
+                return None
+            translation = translation.copy()
+            function(translation)
+            self.stripes[s][id] = translation
+            self._on_put(translation)
+            return translation
+
+    def update_many(self, updates):
+        """
+        Like update_with for a list of (id, function) pairs, but the lock of each stripe is only taken once.
+        Return the new records, or None for the missing ones, in the order of updates.
+        """
+        by_stripe = {}
+        for (i, (id, function)) in enumerate(updates):
+            id = pack_id(id)
+            by_stripe.setdefault(self._stripe_of(id), []).append((i, id, function))
+        translations = [None] * len(updates)
+        for (s, stripe_updates) in by_stripe.items():
+            with self.locks[s]:
+                for (i, id, function) in stripe_updates:
+                    translation = self.stripes[s].get(id)
+                    if translation is None:
+                        continue
+                    translation = translation.copy()
+                    function(translation)
+                    self.stripes[s][id] = translation
+                    self._on_put(translation)
+                    translations[i] = translation
+        return translations
+
+    def remove(self, id, owner=None):
+        """Remove the record. If owner is given, the record is removed only if it belongs to it."""
+        id = pack_id(id)
+        s = self._stripe_of(id)
+        with self.locks[s]:
+            translation = self.stripes[s].get(id)
+            if translation is None or (owner is not None and translation['owner'] != owner):
+                return None
+            del self.stripes[s][id]
+            self._index_remove(translation['owner'], id)
+            self._on_remove(id)
+        return translation
+
+    def remove_if(self, predicate):
+        """Remove all the records matching predicate, one stripe at a time. Return the removed records."""
+        removed = []
+        for s in range(0, self.stripe_count):
+            with self.locks[s]:
+                ids = [k for (k, v) in self.stripes[s].items() if predicate(v)]
+                for id in ids:
+                    translation = self.stripes[s].pop(id)
+                    self._index_remove(translation['owner'], id)
+                    self._on_remove(id)
+                    removed.append(translation)
+        return removed
+
+    def values(self):
+        """Return a snapshot of all the records, taken one stripe at a time."""
+        translations = []
+        for s in range(0, self.stripe_count):
+            with self.locks[s]:
+                translations.extend(self.stripes[s].values())
+        return translations
+
+    def get_by_owner(self, owner):
+        s = self._stripe_of(owner)
+        with self.owner_locks[s]:
+            ids = list(self.owner_stripes[s].get(owner, ()))
+        translations = []
+        for id in ids:
+            translation = self.get(id)
+            if translation is not None:
+                translations.append(translation)
+        return translations
+
+    def get_page(self, cursor=None, limit=100):
+        """
+        Return (translations, next_cursor) where translations is a list of at most limit records.
+        The cursor is an opaque string; pass the returned next_cursor to fetch the next page.
+        next_cursor is None when there are no more records.
+        """
+        stripe, last_id = 0, None
+        if cursor:
+            str_stripe, last_id = cursor.split(':', 1)
+            stripe = int(str_stripe)
+
+        translations = []
+        while stripe < self.stripe_count:
+            with self.locks[stripe]:
+                ids = sorted(unpack_id(id) for id in self.stripes[stripe].keys())
+                start = 0 if last_id is None else bisect.bisect_right(ids, last_id)
+                for id in ids[start:start + limit - len(translations)]:
+                    translations.append(self.stripes[stripe][pack_id(id)])
+            if len(translations) >= limit:
+                last = translations[-1]['id']
+                if bisect.bisect_right(ids, last) < len(ids) or stripe + 1 < self.stripe_count:
+                    return (translations, "{0}:{1}".format(stripe, last))
+                return (translations, None)
+            stripe += 1
+            last_id = None
+        return (translations, None)
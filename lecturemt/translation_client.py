@@ -15,13 +15,6 @@ import os
 import urllib.parse
 import sys
 
-import tensorflow as tf
-from tensor2tensor.utils import usr_dir
-from tensor2tensor.utils import registry
-from tensor2tensor.serving import serving_utils
-
-from nmt_chainer.translation.client import Client
-
 
 class TranslationClientFactory:
 
@@ -42,6 +35,16 @@ class TranslationClient():
     def submit(self, text):
         pass
 
+    def submit_batch(self, texts):
+        # Backends that cannot translate several sentences in one call fall back to one call per sentence.
+        return [self.submit(text) for text in texts]
+
+    def is_healthy(self):
+        return True
+
+    def close(self):
+        pass
+
 
 class OpenNMTClient(TranslationClient):
 
@@ -49,29 +52,57 @@ class OpenNMTClient(TranslationClient):
         self.host = host
         self.port = port
         self.logger = logger
+        self.conn = None
+
+    def _request(self, method, url, body=None, headers={}):
+        # The HTTP connection is kept alive between requests.  If the server closed it
+        # in the meantime, the request is sent once more on a new connection.
+        for attempt in range(0, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("{0}:{1}".format(self.host, self.port), timeout=60)
+            try:
+                self.conn.request(method, url, body, headers)
+                response = self.conn.getresponse()
+                return (response, response.read())
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def is_healthy(self):
+        try:
+            response, data = self._request("GET", "/translator/models")
+            return response.status == 200
+        except Exception:
+            return False
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
     def submit(self, text):
+        return self.submit_batch([text])[0]
+
+    def submit_batch(self, texts):
         json_data = None
-        params = ('[{"src": "' + text + '", "id": 1}]').encode('utf-8')
+        params = json.dumps([{"src": text, "id": 1} for text in texts]).encode('utf-8')
         headers = {"Content-type": "application/json"}
-        conn = http.client.HTTPConnection("{0}:{1}".format(self.host, self.port))
-        conn.request("POST", "/translator/translate", params, headers)
-        response = conn.getresponse()
+        response, data = self._request("POST", "/translator/translate", params, headers)
         self.logger.debug("status={0} reason={1}".format(response.status, response.reason))
         if response.status == 200:
-            data = response.read()
             self.logger.debug("data={0}".format(data))
             try:
                 json_data = json.loads(data)
             except Exception as e:
                 self.logger.error("Error when loading json e={0}".format(e))
 
+        # The response contains one list of results per batch; each result corresponds to a src, in order.
         if json_data:
-            if len(json_data) == 1 and len(json_data[0]) == 1 and 'tgt' in json_data[0][0]:
-                translated_text = json_data[0][0]['tgt']
-                return translated_text
+            if len(json_data) == 1 and len(json_data[0]) == len(texts) and all('tgt' in result for result in json_data[0]):
+                return [result['tgt'] for result in json_data[0]]
 
-        return ''
+        return ['' for text in texts]
 
         # This works
         #
@@ -97,6 +128,7 @@ class OpenNMTClient(TranslationClient):
 class KNMTClient(TranslationClient):
 
     def __init__(self, host='localhost', port=46001, logger=None):
+        from nmt_chainer.translation.client import Client
         self.host = host
         self.port = port
         self.logger = logger
@@ -118,7 +150,21 @@ class KNMTClient(TranslationClient):
 
 class TensorFlowClient(TranslationClient):
 
+    # TensorFlow, Tensor2Tensor and the gRPC modules are only needed by this client, so they are imported here.
     def __init__(self, host='localhost', port=46001, logger=None):
+        import grpc
+        import tensorflow as tf
+        from tensor2tensor.utils import registry, usr_dir
+        from tensor2tensor.serving import serving_utils
+        from tensorflow_serving.apis import predict_pb2
+        from tensorflow_serving.apis import prediction_service_pb2_grpc
+        self.grpc = grpc
+        self.tf = tf
+        self.registry = registry
+        self.usr_dir_module = usr_dir
+        self.serving_utils = serving_utils
+        self.predict_pb2 = predict_pb2
+        self.prediction_service_pb2_grpc = prediction_service_pb2_grpc
         self.host = host
         self.port = port
         self.logger = logger
@@ -134,24 +180,51 @@ class TensorFlowClient(TranslationClient):
             self.servable_name = params["ServableName"]
 
     def prepare(self):
-        usr_dir.import_usr_dir(self.usr_dir)
-        self.problem = registry.problem(self.problem_name)
-        self.hparams = tf.contrib.training.HParams(data_dir=os.path.expanduser(self.hparams_dir))
+        self.usr_dir_module.import_usr_dir(self.usr_dir)
+        self.problem = self.registry.problem(self.problem_name)
+        self.hparams = self.tf.contrib.training.HParams(data_dir=os.path.expanduser(self.hparams_dir))
         self.problem.get_hparams(self.hparams)
         self.request_fn = self._make_request_fn()
 
     def _make_request_fn(self):
-        request_fn = serving_utils.make_grpc_request_fn(servable_name=self.servable_name, server="{0}:{1}".format(self.host, self.port), timeout_secs=10)
-        return request_fn
+        # Unlike serving_utils.make_grpc_request_fn which opens a new channel for every request,
+        # the channel is opened once here and reused by all the requests.
+        self.channel = self.grpc.insecure_channel("{0}:{1}".format(self.host, self.port))
+        stub = self.prediction_service_pb2_grpc.PredictionServiceStub(self.channel)
+        timeout_secs = 10
+
+        def _make_grpc_request(examples):
+            request = self.predict_pb2.PredictRequest()
+            request.model_spec.name = self.servable_name
+            request.inputs["input"].CopyFrom(
+                self.tf.contrib.util.make_tensor_proto([ex.SerializeToString() for ex in examples], shape=[len(examples)]))
+            response = stub.Predict(request, timeout_secs)
+            outputs = self.tf.make_ndarray(response.outputs["outputs"])
+            scores = self.tf.make_ndarray(response.outputs["scores"])
+            assert len(outputs) == len(scores)
+            return [{"outputs": output, "scores": score} for output, score in zip(outputs, scores)]
+
+        return _make_grpc_request
+
+    def is_healthy(self):
+        try:
+            self.grpc.channel_ready_future(self.channel).result(timeout=5)
+            return True
+        except self.grpc.FutureTimeoutError:
+            return False
+
+    def close(self):
+        self.channel.close()
 
     def submit(self, text):
-        outputs = serving_utils.predict([text], self.problem, self.request_fn)
-        print("outputs type={0}".format(type(outputs)))
-        output, = outputs
+        return self.submit_batch([text])[0]
 
-        headers = {"Content-type": "application/json"}
-        translated_text = output[0]
-        return translated_text
+    def submit_batch(self, texts):
+        outputs = self.serving_utils.predict(texts, self.problem, self.request_fn)
+        self.logger.debug("outputs type={0}".format(type(outputs)))
+
+        translated_texts = [output[0] for output in outputs]
+        return translated_texts
 
 
 def main():
@@ -7,20 +7,26 @@ __version__ = "1.0"
 __email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
 __status__ = "Development"
 
+import collections
 import configparser
 import datetime
 import json
 import logging
 import logging.config
-import pika
-import re
-import subprocess
 import sys
 import threading
 import time
 import timeit
 
+from cache import TranslationCache
+from metrics import MetricsHttpServer, MetricsRegistry
+from scheduling import DEFAULT_WEIGHTS, PRIORITIES, FairQueue, cancel_exchange_name, request_queue_name, response_queue_name
+from segmenter import SegmenterFactory
 from translation_client import TensorFlowClient, OpenNMTClient, KNMTClient, TranslationClientFactory
+from transport import LocalTransport, TransportFactory
+
+# In seconds.  Delay before the requests of a batch whose translation failed are given back to the broker.
+BACKEND_RETRY_DELAY = 1
 
 log = None
  
@@ -29,16 +35,14 @@ logging.basicConfig()
 
 class Worker(threading.Thread):
 
-    def __init__(self, name, lang_pair, 
-        rabbitmq_host, rabbitmq_port, rabbitmq_username, rabbitmq_password,
-        translator_type, translator_host, translator_port, segmenter_host, segmenter_port, segmenter_command, extra_params=None):
+    def __init__(self, name, lang_pair, transport,
+        translator_type, translator_host, translator_port, segmenter_host, segmenter_port, segmenter_command, extra_params=None,
+        max_batch_size=1, max_batch_wait=0.0, prefetch_count=None, health_check_interval=60, segmenter_type=None, segmenter_params={}, cache=None,
+        lane_weights=DEFAULT_WEIGHTS, batch_prefetch_count=None, metrics=None):
         threading.Thread.__init__(self)
         self.name = name
         self.lang_pair = lang_pair
-        self.rabbitmq_host = rabbitmq_host
-        self.rabbitmq_port = rabbitmq_port
-        self.rabbitmq_username = rabbitmq_username
-        self.rabbitmq_password = rabbitmq_password
+        self.transport = transport
         self.lang_source, self.lang_target = self.lang_pair.split("-")
         self.translator_type = translator_type
         self.translator_host = translator_host
@@ -46,65 +50,501 @@ class Worker(threading.Thread):
         self.segmenter_host = segmenter_host
         self.segmenter_port = segmenter_port
         self.segmenter_command = segmenter_command
+        if segmenter_type is None:
+            segmenter_type = "No" if segmenter_command == '' else "Command"
+        self.segmenter = SegmenterFactory.create("{0}Segmenter".format(segmenter_type), segmenter_host, segmenter_port, segmenter_command, log, **segmenter_params)
         self.extra_params = extra_params
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.prefetch_count = prefetch_count if prefetch_count is not None else max_batch_size
+        # More batch messages are prefetched so that the requests of several users can be interleaved.
+        self.batch_prefetch_count = batch_prefetch_count if batch_prefetch_count is not None else 4 * self.prefetch_count
+        self.lane_weights = lane_weights
+        self.health_check_interval = health_check_interval
+        self.cache = cache
+        self.client = None
+        self.client_last_used = 0
+        self.stopping = threading.Event()
+        # Latest revision received for each stream segment, to skip the superseded ones.
+        self.segment_revisions = collections.OrderedDict()
+        # Ids of the translations cancelled by the server, most recent last.
+        self.cancelled_ids = collections.OrderedDict()
+
+        # The queue wait is measured against the submission time set by the server, so it includes
+        # any clock difference between the server and the translator hosts.
+        # The workers of a pool share the registry of their supervisor.
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.queue_wait = self.metrics.histogram('lecturemt_translator_queue_wait_seconds', 'Time between the submission of a translation and its reception by the translator.', ('worker',))
+        self.segmentation_latency = self.metrics.histogram('lecturemt_translator_segmentation_seconds', 'Time to segment a batch.', ('worker',))
+        self.inference_latency = self.metrics.histogram('lecturemt_translator_inference_seconds', 'Time to translate a batch with the backend.', ('worker',))
+        self.publish_latency = self.metrics.histogram('lecturemt_translator_publish_seconds', 'Time to publish the responses of a batch.', ('worker',))
+        self.batch_size = self.metrics.histogram('lecturemt_translator_batch_size', 'Number of requests per batch.', ('worker',), buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.cache_lookups = self.metrics.counter('lecturemt_translator_cache_lookups_total', 'Number of cache lookups by result.', ('worker', 'result'))
+        self.skipped_requests = self.metrics.counter('lecturemt_translator_skipped_requests_total', 'Number of requests skipped without being translated, by reason.', ('worker', 'reason'))
         translator_str = "{0}:{1}".format(translator_host, translator_port)
-        segmenter_str = "None" if segmenter_command == "" else "{0}:{1}".format(segmenter_host, segmenter_port) 
-        log.debug("Creating translation worker: name={0} lang_pair={1} translator={2} segmenter={3} extra_params=".format(name, lang_pair, translator_str, segmenter_str, self.extra_params))
+        segmenter_str = "None" if segmenter_type == "No" else "{0}:{1} ({2})".format(segmenter_host, segmenter_port, segmenter_type)
+        log.debug("Creating translation worker: name={0} lang_pair={1} translator={2} segmenter={3} extra_params={4} max_batch_size={5} max_batch_wait={6}".format(name, lang_pair, translator_str, segmenter_str, self.extra_params, max_batch_size, max_batch_wait))
 
-    def run(self):
-        while True:
-            credentials = pika.PlainCredentials(self.rabbitmq_username, self.rabbitmq_password)
-            connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.rabbitmq_host, port=self.rabbitmq_port, credentials=credentials))
-            channel = connection.channel()
+    def create_client(self):
+        client = TranslationClientFactory.create("{0}Client".format(self.translator_type), self.translator_host, int(self.translator_port), log)
+        if self.extra_params is not None:
+            client.set_extra_params(self.extra_params)
+        client.prepare()
+        return client
+
+    def get_client(self):
+        # The client is created and prepared once, then kept for the next requests.
+        # It is checked again only when it has been idle for a while, and rebuilt if needed.
+        now = timeit.default_timer()
+        if self.client is not None and now - self.client_last_used > self.health_check_interval and not self.client.is_healthy():
+            log.info("T-{0}: translation client is unhealthy. Rebuilding it.".format(self.name))
+            self.discard_client()
+        if self.client is None:
+            self.client = self.create_client()
+        self.client_last_used = now
+        return self.client
+
+    def discard_client(self):
+        if self.client is not None:
+            try:
+                self.client.close()
+            except:
+                pass
+            self.client = None
+
+    def publish_response(self, channel, translation, translated_text):
+        log.debug("trans_req_id={0} translated_text={1}".format(translation['id'], translated_text))
+
+        # The response goes back to the instance of the server that sent the request.
+        resp_queue_name = translation.get('reply_to', response_queue_name(self.lang_pair))
+        channel.queue_declare(queue=resp_queue_name, durable=True)
 
-            req_queue_name = 'trans_req_{0}'.format(self.lang_pair)
-            channel.queue_declare(queue=req_queue_name, durable=True)
+        response = {'id': translation['id'], 'translated_text': translated_text}
+        if 'revision' in translation:
+            response['revision'] = translation['revision']
+        message = json.dumps(response)
+        channel.basic_publish(exchange='', routing_key=resp_queue_name, body=message, properties=self.transport.make_properties())
 
-            def process_translation_request(ch, method, properties, body):
+    def translate_texts(self, texts):
+        if self.cache is None:
+            return self.translate_uncached_texts(texts)
+
+        # Only the texts that are not found in the cache are sent to the segmenter and translator.
+        translated_texts = [self.cache.get(text) for text in texts]
+        missing = [i for i, translated_text in enumerate(translated_texts) if translated_text is None]
+        self.cache_lookups.inc(self.name, 'hit', amount=len(texts) - len(missing))
+        self.cache_lookups.inc(self.name, 'miss', amount=len(missing))
+        if missing:
+            for (i, translated_text) in zip(missing, self.translate_uncached_texts([texts[i] for i in missing])):
+                translated_texts[i] = translated_text
+                if translated_text != '':
+                    self.cache.put(texts[i], translated_text)
+        log.debug("T-{0}: cache stats={1}".format(self.name, self.cache.get_stats()))
+        return translated_texts
+
+    def translate_uncached_texts(self, texts):
+        start = timeit.default_timer()
+        try:
+            segmented_texts = self.segmenter.segment_batch(texts)
+        except:
+            self.segmenter.close()
+            raise
+        self.segmentation_latency.observe(timeit.default_timer() - start, self.name)
+
+        start = timeit.default_timer()
+        try:
+            translated_texts = self.get_client().submit_batch(segmented_texts)
+            self.inference_latency.observe(timeit.default_timer() - start, self.name)
+            return translated_texts
+        except:
+            # The client will be rebuilt for the next batch.
+            self.discard_client()
+            raise
+
+    def process_translation_requests(self, channel, messages):
+        """Translate a batch of (method, properties, body) messages with a single backend call, then publish and ack each result."""
+        start_request = timeit.default_timer()
+        now = time.time()
+        translations = []
+        for (method, properties, body) in messages:
+            try:
+                translation = json.loads(body) 
+                log.debug("T-{0}: translation: {1}".format(self.name, translation))
+                log.debug("T-{0}: text to translate: {1}".format(self.name, translation['text_source']))
+                skip_reason = self.get_skip_reason(translation, now)
+                if skip_reason is not None:
+                    log.debug("T-{0}: request {1} skipped: {2}.".format(self.name, translation['id'], skip_reason))
+                    self.skipped_requests.inc(self.name, skip_reason)
+                    channel.basic_ack(delivery_tag = method.delivery_tag)
+                    continue
+                translations.append((method, translation))
+                if 'time_submitted' in translation:
+                    self.queue_wait.observe(max(0.0, now - translation['time_submitted']), self.name)
+            except:
+                log.debug("Unexpected error: {0}\n".format(sys.exc_info()[0]))
+                channel.basic_ack(delivery_tag = method.delivery_tag)
+
+        if translations:
+            self.batch_size.observe(len(translations), self.name)
+            try:
+                translated_texts = self.translate_texts([translation['text_source'] for (method, translation) in translations])
+                start_publish = timeit.default_timer()
+                for ((method, translation), translated_text) in zip(translations, translated_texts):
+                    self.publish_response(channel, translation, translated_text)
+                self.publish_latency.observe(timeit.default_timer() - start_publish, self.name)
+                for (method, translation) in translations:
+                    channel.basic_ack(delivery_tag = method.delivery_tag)
+            except:
+                log.warning("T-{0}: the translation of {1} request(s) failed: {2}".format(self.name, len(translations), sys.exc_info()[1]))
+                self.handle_failed_requests(channel, translations)
+
+        processing_time = timeit.default_timer() - start_request
+        log.debug("Finish processing {0} request(s) {1} by translation worker {2} in {3} s.".format(len(translations), [t['id'] for (m, t) in translations], self.name, processing_time)) 
+
+    def handle_failed_requests(self, channel, translations):
+        # The requests are given back to the broker, so that they are translated again once the backend
+        # works again, possibly by another worker.  The requests that fail a second time are translated one
+        # by one, so that a text that the backend cannot translate does not make the rest of its batch fail.
+        # A request that still fails is dropped.
+        time.sleep(BACKEND_RETRY_DELAY)
+        for (method, translation) in translations:
+            if not method.redelivered:
+                channel.basic_nack(delivery_tag = method.delivery_tag, requeue=True)
+        for (method, translation) in translations:
+            if not method.redelivered:
+                continue
+            translated = False
+            if len(translations) > 1:
                 try:
-                    start_request = timeit.default_timer()
-                    translation = json.loads(body) 
-                    log.debug("T-{0}: translation: {1}".format(self.name, translation))
-                    log.debug("T-{0}: text to translate: {1}".format(self.name, translation['text_source']))
-
-                    if self.segmenter_command == '':
-                        segmenter_output = translation['text_source']
-                    else:
-                        segmenter_cmd = re.sub(r'TEXT', translation['text_source'], self.segmenter_command)
-                        segmenter_cmd = re.sub(r'HOST', self.segmenter_host, segmenter_cmd)
-                        segmenter_cmd = re.sub(r'PORT', self.segmenter_port, segmenter_cmd)
-                        log.debug("T-{0}: cmd={1}".format(self.name, segmenter_cmd))
-
-                        segmenter_output = subprocess.check_output(segmenter_cmd, shell=True, universal_newlines=True)
-                        segmenter_output = segmenter_output.strip()
-                        log.debug("T-{0}: segmenter_output={1}".format(self.name, segmenter_output))
-                    
-                    client = TranslationClientFactory.create("{0}Client".format(self.translator_type), self.translator_host, int(self.translator_port), log)
-                    if self.extra_params is not None:
-                        client.set_extra_params(self.extra_params)
-                    client.prepare()
-                    translated_text = client.submit(segmenter_output)
-
-                    log.debug("trans_req_id={0} translated_text={1}".format(translation['id'], translated_text))
-
-                    resp_queue_name = 'trans_resp_{0}'.format(self.lang_pair)
-                    channel.queue_declare(queue=resp_queue_name, durable=True)
-
-                    message = json.dumps({'id': translation['id'], 'translated_text': translated_text})
-                    channel.basic_publish(exchange='', routing_key=resp_queue_name, body=message, 
-                        properties=pika.BasicProperties( delivery_mode = 2, # make message persistent
-                    ))
-
-                    processing_time = timeit.default_timer() - start_request
-                    log.debug("Finish processing request {0} by translation worker {1} in {2} s.".format(translation['id'], self.name, processing_time)) 
+                    self.publish_response(channel, translation, self.translate_texts([translation['text_source']])[0])
+                    translated = True
                 except:
                     log.debug("Unexpected error: {0}\n".format(sys.exc_info()[0]))
-                ch.basic_ack(delivery_tag = method.delivery_tag)
+            if not translated:
+                log.warning("T-{0}: request {1} dropped after a second failure.".format(self.name, translation['id']))
+                self.skipped_requests.inc(self.name, 'failed')
+            channel.basic_ack(delivery_tag = method.delivery_tag)
+
+    def get_skip_reason(self, translation, now):
+        """Return why the request does not need to be translated anymore, or None."""
+        if translation['id'] in self.cancelled_ids or translation.get('parent_id') in self.cancelled_ids:
+            return 'cancelled'
+        # The expiration time is set by the server, so it is subject to the clock difference between the hosts.
+        if 'time_expiry' in translation and translation['time_expiry'] <= now:
+            return 'expired'
+        if 'revision' in translation and translation['revision'] < self.segment_revisions.get(translation['id'], -1):
+            return 'superseded'
+        return None
+
+    def collect_cancellations(self, channel, method, properties, body):
+        try:
+            ids = json.loads(body)['ids']
+        except:
+            log.debug("T-{0}: invalid cancellation message: {1}".format(self.name, body))
+            return
+        for id in ids:
+            self.cancelled_ids[id] = None
+            self.cancelled_ids.move_to_end(id)
+        while len(self.cancelled_ids) > 100000:
+            self.cancelled_ids.popitem(last=False)
+
+    def note_segment_revision(self, id, revision):
+        if revision > self.segment_revisions.get(id, -1):
+            self.segment_revisions[id] = revision
+            self.segment_revisions.move_to_end(id)
+            if len(self.segment_revisions) > 10000:
+                self.segment_revisions.popitem(last=False)
+
+    def stop(self):
+        """Stop the worker after it has processed the messages it has already received."""
+        self.stopping.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            connection = self.transport.connect()
+            channel = connection.channel()
+
+            # The consumer callbacks only collect the messages in a fair queue, by priority and owner.
+            # They are then taken in batches of at most max_batch_size messages.  A batch is processed
+            # as soon as it is full or max_batch_wait seconds after its first message arrived.
+            pending = FairQueue(self.lane_weights)
+            def make_collector(priority):
+                def collect_translation_request(ch, method, properties, body):
+                    try:
+                        translation = json.loads(body)
+                        owner = translation.get('owner', '')
+                        if 'revision' in translation:
+                            self.note_segment_revision(translation['id'], translation['revision'])
+                    except:
+                        owner = ''
+                    pending.put(priority, owner, (method, properties, body))
+                return collect_translation_request
+
+            # The prefetch count applies to each consumer, so the live requests are never stuck
+            # behind the batch requests prefetched by the same worker.
+            consumer_tags = []
+            for priority in PRIORITIES:
+                req_queue_name = request_queue_name(self.lang_pair, priority)
+                channel.queue_declare(queue=req_queue_name, durable=True)
+                channel.basic_qos(prefetch_count=self.prefetch_count if priority == 'live' else self.batch_prefetch_count)
+                consumer_tags.append(channel.basic_consume(req_queue_name, make_collector(priority)))
+
+            # Each worker has its own queue bound to the cancellation exchange of its language pair,
+            # so that all the workers learn about the cancelled translations.  The queue is deleted
+            # with the connection.
+            channel.exchange_declare(exchange=cancel_exchange_name(self.lang_pair), exchange_type='fanout')
+            cancel_queue_name = channel.queue_declare(queue='', exclusive=True).method.queue
+            channel.queue_bind(queue=cancel_queue_name, exchange=cancel_exchange_name(self.lang_pair))
+            channel.basic_consume(cancel_queue_name, self.collect_cancellations, auto_ack=True)
+
+            while not self.stopping.is_set():
+                while not pending and not self.stopping.is_set():
+                    connection.process_data_events(time_limit=1)
+                if not pending:
+                    break
+
+                deadline = timeit.default_timer() + self.max_batch_wait
+                while len(pending) < self.max_batch_size:
+                    remaining = deadline - timeit.default_timer()
+                    if remaining <= 0:
+                        break
+                    connection.process_data_events(time_limit=remaining)
+
+                self.process_translation_requests(channel, pending.take(self.max_batch_size))
+
+            # Drain: no more messages are delivered to this worker and those it has already received
+            # are processed and acked, so that they are not delivered again to another worker.
+            for consumer_tag in consumer_tags:
+                channel.basic_cancel(consumer_tag)
+            while pending:
+                self.process_translation_requests(channel, pending.take(self.max_batch_size))
+            connection.close()
+            self.discard_client()
+            log.info("T-{0}: stopped.".format(self.name))
+
+
+class Supervisor(threading.Thread):
+
+    # Runs a pool of workers built from the same worker config.  Every interval seconds, the number
+    # of messages waiting in the request queues and the mean queue wait of the last interval are checked.
+    # A worker is added when more than scale_up_queue_depth messages are waiting per worker or when
+    # the mean queue wait exceeds scale_up_queue_wait.  The newest worker is stopped when the queues have
+    # been empty with a mean queue wait under scale_down_queue_wait for scale_down_intervals intervals in a row.
+    # There are always between min_workers and max_workers workers, and at most one change per interval.
+    #
+    # Each worker is bound to one of the endpoints (host, port, capacity) of the backend.  An endpoint
+    # serves at most capacity workers, including the stopped workers that are still draining.
+    def __init__(self, worker_config, transport, endpoints, min_workers=1, max_workers=4, interval=10,
+        scale_up_queue_depth=10, scale_up_queue_wait=1.0, scale_down_queue_wait=0.1, scale_down_intervals=3):
+        threading.Thread.__init__(self)
+        self.name = "Supervisor_{0}".format(worker_config['Translation']['Id'])
+        self.daemon = True
+        self.worker_config = worker_config
+        self.transport = transport
+        self.endpoints = endpoints
+        self.min_workers = min_workers
+        self.max_workers = min(max_workers, sum(capacity for (host, port, capacity) in endpoints))
+        self.interval = interval
+        self.scale_up_queue_depth = scale_up_queue_depth
+        self.scale_up_queue_wait = scale_up_queue_wait
+        self.scale_down_queue_wait = scale_down_queue_wait
+        self.scale_down_intervals = scale_down_intervals
+        self.workers = []
+        self.draining_workers = []
+        self.worker_count = 0
+        self.idle_intervals = 0
+        self.cache = create_cache(worker_config)
+        self.metrics = MetricsRegistry()
+        self.metrics.gauge('lecturemt_translator_pool_size', 'Number of workers of the pool.', function=lambda: len(self.workers))
+        self.queue_wait = self.metrics.histogram('lecturemt_translator_queue_wait_seconds', 'Time between the submission of a translation and its reception by the translator.', ('worker',))
+        self.last_queue_wait_totals = (0, 0.0)
+        self.connection = None
 
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(req_queue_name, process_translation_request)
+    def _free_endpoint(self):
+        used = {}
+        for worker in self.workers + self.draining_workers:
+            used[worker.endpoint] = used.get(worker.endpoint, 0) + 1
+        for (host, port, capacity) in self.endpoints:
+            if used.get((host, port), 0) < capacity:
+                return (host, port)
+        return None
 
-            channel.start_consuming()
+    def add_worker(self):
+        endpoint = self._free_endpoint()
+        if endpoint is None:
+            return False
+        self.worker_count += 1
+        name = "{0}_{1}".format(self.worker_config['Translation']['Id'], self.worker_count)
+        worker = create_worker(self.worker_config, self.transport, name=name, host=endpoint[0], port=endpoint[1], cache=self.cache, metrics=self.metrics)
+        worker.endpoint = endpoint
+        worker.start()
+        self.workers.append(worker)
+        log.info("{0}: started {1} on {2}:{3} ({4} workers).".format(self.name, name, endpoint[0], endpoint[1], len(self.workers)))
+        return True
+
+    def remove_worker(self):
+        worker = self.workers.pop()
+        worker.stop()
+        self.draining_workers.append(worker)
+        log.info("{0}: stopping {1} ({2} workers).".format(self.name, worker.name, len(self.workers)))
+
+    def get_queue_depth(self):
+        try:
+            if self.connection is None:
+                self.connection = self.transport.connect()
+                self.channel = self.connection.channel()
+            lang_pair = self.worker_config['Translation']['LanguagePair']
+            return sum(self.channel.queue_declare(queue=request_queue_name(lang_pair, priority), durable=True, passive=True).method.message_count for priority in PRIORITIES)
+        except Exception as e:
+            log.debug("{0}: cannot read the queue depth: {1}".format(self.name, e))
+            self.close_connection()
+            return None
+
+    def close_connection(self):
+        # The connection is kept between the checks.  After an error, it is closed and reopened at the next check.
+        try:
+            if self.connection is not None:
+                self.connection.close()
+        except Exception as e:
+            log.debug("{0}: cannot close the connection: {1}".format(self.name, e))
+        finally:
+            self.connection = None
+
+    def get_mean_queue_wait(self):
+        (count, total) = self.queue_wait.get_totals()
+        (last_count, last_total) = self.last_queue_wait_totals
+        self.last_queue_wait_totals = (count, total)
+        return (total - last_total) / (count - last_count) if count > last_count else 0.0
+
+    def adjust(self):
+        # Workers that died are replaced.
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+        self.draining_workers = [worker for worker in self.draining_workers if worker.is_alive()]
+        while len(self.workers) < self.min_workers and self.add_worker():
+            pass
+
+        queue_depth = self.get_queue_depth()
+        mean_queue_wait = self.get_mean_queue_wait()
+        log.debug("{0}: workers={1} queue_depth={2} mean_queue_wait={3}".format(self.name, len(self.workers), queue_depth, mean_queue_wait))
+        if queue_depth is None:
+            return
+
+        if queue_depth > self.scale_up_queue_depth * len(self.workers) or mean_queue_wait > self.scale_up_queue_wait:
+            self.idle_intervals = 0
+            if len(self.workers) < self.max_workers:
+                self.add_worker()
+        elif queue_depth == 0 and mean_queue_wait <= self.scale_down_queue_wait:
+            self.idle_intervals += 1
+            if self.idle_intervals >= self.scale_down_intervals and len(self.workers) > self.min_workers:
+                self.remove_worker()
+                self.idle_intervals = 0
+        else:
+            self.idle_intervals = 0
+
+    def run(self):
+        while True:
+            # An error must not stop the supervision: the next interval is given another chance.
+            try:
+                self.adjust()
+            except Exception as e:
+                log.error("{0}: cannot adjust the workers: {1!r}".format(self.name, e))
+            time.sleep(self.interval)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join()
+        self.close_connection()
+
+
+def create_cache(worker_config):
+    """Return the translation cache described by the [Cache] section of worker_config, or None."""
+    if not "Cache" in worker_config or not worker_config["Cache"].getboolean("Enabled", True):
+        return None
+    extra_params = worker_config["ExtraParameters"] if "ExtraParameters" in worker_config else None
+    # Any change of the backend or of its parameters invalidates the cached translations.
+    # ModelVersion must be changed when the model is replaced behind the same backend.
+    backend_description = "{0}|{1}|{2}|{3}|{4}".format(worker_config['Translation']['Type'],
+        worker_config['Translation']['Host'], worker_config['Translation']['Port'],
+        sorted(extra_params.items()) if extra_params is not None else None,
+        worker_config["Cache"].get("ModelVersion", ""))
+    ttl = float(worker_config["Cache"]["TTL"]) if "TTL" in worker_config["Cache"] else None
+    return TranslationCache(worker_config['Translation']['Id'], worker_config['Translation']['LanguagePair'], backend_description,
+        max_entries=int(worker_config["Cache"].get("MaxEntries", 100000)), ttl=ttl,
+        disk_path=worker_config["Cache"].get("DiskPath", None),
+        max_disk_entries=int(worker_config["Cache"].get("MaxDiskEntries", 1000000)), logger=log)
+
+def create_supervisor(worker_config, transport):
+    """Create the supervisor described by the [Supervisor] section of worker_config."""
+    section = worker_config["Supervisor"]
+    max_workers = int(section.get("MaxWorkers", 4))
+    # Endpoints: host:port:capacity, ...  By default, the backend of the [Translation] section serves all the workers.
+    endpoints = []
+    for endpoint in section.get("Endpoints", "").split(","):
+        if endpoint.strip():
+            (host, port, capacity) = endpoint.strip().split(":")
+            endpoints.append((host, port, int(capacity)))
+    if not endpoints:
+        endpoints = [(worker_config['Translation']['Host'], worker_config['Translation']['Port'], max_workers)]
+    return Supervisor(worker_config, transport, endpoints,
+        min_workers=int(section.get("MinWorkers", 1)), max_workers=max_workers,
+        interval=float(section.get("Interval", 10)),
+        scale_up_queue_depth=int(section.get("ScaleUpQueueDepth", 10)),
+        scale_up_queue_wait=float(section.get("ScaleUpQueueWait", 1.0)),
+        scale_down_queue_wait=float(section.get("ScaleDownQueueWait", 0.1)),
+        scale_down_intervals=int(section.get("ScaleDownIntervals", 3)))
+
+def create_worker(worker_config, transport, name=None, host=None, port=None, cache=None, metrics=None):
+    """
+    Create the worker described by worker_config.  name, host and port override those of the [Translation] section.
+    Unless a cache and a metrics registry are given, the worker gets its own and, if the [Metrics] section has a Port,
+    its metrics server is started.
+    """
+    extra_params = worker_config["ExtraParameters"] if "ExtraParameters" in worker_config else None
+
+    max_batch_size = 1
+    max_batch_wait = 0.0
+    prefetch_count = None
+    if "Batching" in worker_config:
+        max_batch_size = int(worker_config["Batching"].get("MaxBatchSize", 1))
+        max_batch_wait = float(worker_config["Batching"].get("MaxBatchWait", 0.0))
+        if "PrefetchCount" in worker_config["Batching"]:
+            prefetch_count = int(worker_config["Batching"]["PrefetchCount"])
+
+    health_check_interval = float(worker_config['Translation'].get('HealthCheckInterval', 60))
+
+    lane_weights = dict(DEFAULT_WEIGHTS)
+    batch_prefetch_count = None
+    if "Scheduling" in worker_config:
+        for priority in PRIORITIES:
+            lane_weights[priority] = float(worker_config["Scheduling"].get("{0}Weight".format(priority.capitalize()), lane_weights[priority]))
+        if "BatchPrefetchCount" in worker_config["Scheduling"]:
+            batch_prefetch_count = int(worker_config["Scheduling"]["BatchPrefetchCount"])
+
+    segmenter_type = worker_config['Segmentation'].get('Type', None)
+    segmenter_params = {}
+    if segmenter_type == 'Socket':
+        segmenter_params['persistent'] = worker_config['Segmentation'].getboolean('Persistent', True)
+        segmenter_params['buffer_size'] = int(worker_config['Segmentation'].get('BufferSize', 32768))
+
+    if cache is None:
+        cache = create_cache(worker_config)
+
+    worker = Worker(name or worker_config['Translation']['Id'], worker_config['Translation']['LanguagePair'], transport,
+        worker_config['Translation']['Type'], 
+        host or worker_config['Translation']['Host'], port or worker_config['Translation']['Port'],
+        worker_config['Segmentation']['Host'], worker_config['Segmentation']['Port'],
+        worker_config['Segmentation'].get('Command', ''), extra_params=extra_params,
+        max_batch_size=max_batch_size, max_batch_wait=max_batch_wait, prefetch_count=prefetch_count,
+        health_check_interval=health_check_interval, segmenter_type=segmenter_type, segmenter_params=segmenter_params,
+        cache=cache, lane_weights=lane_weights, batch_prefetch_count=batch_prefetch_count, metrics=metrics)
+
+    if metrics is None and "Metrics" in worker_config and "Port" in worker_config["Metrics"]:
+        metrics_server = MetricsHttpServer(worker.metrics, worker_config["Metrics"].get("Host", ""), int(worker_config["Metrics"]["Port"]))
+        metrics_server.start()
+
+    return worker
 
 def do_start_worker(config_file, worker_config_file, worker_logging_config_file):
     if worker_logging_config_file:
@@ -118,14 +558,27 @@ def do_start_worker(config_file, worker_config_file, worker_logging_config_file)
     worker_config = configparser.ConfigParser()
     worker_config.read(worker_config_file)
 
-    extra_params = worker_config["ExtraParameters"] if "ExtraParameters" in worker_config else None
+    # A translator started on its own can only reach the server through a broker.
+    transport = TransportFactory.create(config)
+    if isinstance(transport, LocalTransport):
+        log.error("With the local transport, the translators are started by the server from the Translators key of the [Transport] section.")
+        exit(1)
 
-    worker = Worker(worker_config['Translation']['Id'], worker_config['Translation']['LanguagePair'], 
-        config['RabbitMQ']['Host'], config['RabbitMQ']['Port'], config['RabbitMQ']['Username'], config['RabbitMQ']['Password'],
-        worker_config['Translation']['Type'], 
-        worker_config['Translation']['Host'], worker_config['Translation']['Port'],
-        worker_config['Segmentation']['Host'], worker_config['Segmentation']['Port'],
-        worker_config['Segmentation']['Command'], extra_params=extra_params)
+    if "Supervisor" in worker_config:
+        supervisor = create_supervisor(worker_config, transport)
+        if "Metrics" in worker_config and "Port" in worker_config["Metrics"]:
+            metrics_server = MetricsHttpServer(supervisor.metrics, worker_config["Metrics"].get("Host", ""), int(worker_config["Metrics"]["Port"]))
+            metrics_server.start()
+        supervisor.start()
+        try:
+            while supervisor.is_alive():
+                supervisor.join(1)
+        except KeyboardInterrupt:
+            log.info("Stopping the workers...")
+            supervisor.stop()
+        return
+
+    worker = create_worker(worker_config, transport)
     worker.start()
 
 if __name__ == "__main__":
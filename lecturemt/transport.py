@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""transport.py: Message transports between the server and the translation workers."""
+__author__ = "Frederic Bergeron"
+__license__ = "undecided"
+__version__ = "1.0"
+__email__ = "bergeron@nlp.ist.i.kyoto-u.ac.jp"
+__status__ = "Development"
+
+
+class TransportFactory:
+
+    @staticmethod
+    def create(config):
+        """Create the transport described by the [Transport] section of config.ini.  RabbitMQ is used by default."""
+        transport_type = config['Transport'].get('Type', 'RabbitMQ') if 'Transport' in config else 'RabbitMQ'
+        transport = globals()["{0}Transport".format(transport_type)](config)
+        return transport
+
+
+class Transport():
+
+    # A transport opens connections that expose the subset of the pika BlockingConnection API
+    # used by LectureMT: channel(), process_data_events(), close() and, on the channels,
+    # queue_declare(), exchange_declare(), queue_bind(), basic_qos(), basic_consume(), basic_cancel(),
+    # basic_publish(), basic_ack(), basic_nack(), confirm_delivery() and start_consuming().
+
+    # Raised by basic_publish when a message cannot be routed to a queue.
+    unroutable_error = Exception
+
+    # Raised by a passive queue_declare when the queue does not exist.  The channel is closed by the broker.
+    channel_closed_error = Exception
+
+    def connect(self):
+        pass
+
+    def make_properties(self, expiration=None):
+        """
+        Return the properties of the translation messages.  If expiration is given, in seconds,
+        the broker drops the message when it has not been consumed by then.
+        """
+        return None
+
+    @staticmethod
+    def format_expiration(expiration):
+        # Like AMQP, the expiration is given to the broker as a number of milliseconds in a string.
+        return None if expiration is None else str(max(0, int(expiration * 1000)))
+
+
+class RabbitMQTransport(Transport):
+
+    # Messages go through a RabbitMQ broker, so the server and the translators can run on different hosts.
+    # The messages are persistent unless Persistent is set to no in the [RabbitMQ] section.
+    def __init__(self, config):
+        import pika
+        self.pika = pika
+        self.host = config['RabbitMQ']['Host']
+        self.port = config['RabbitMQ']['Port']
+        self.username = config['RabbitMQ']['Username']
+        self.password = config['RabbitMQ']['Password']
+        self.delivery_mode = 2 if config['RabbitMQ'].getboolean('Persistent', True) else 1
+        self.unroutable_error = pika.exceptions.UnroutableError
+        self.channel_closed_error = pika.exceptions.ChannelClosedByBroker
+
+    def connect(self):
+        credentials = self.pika.PlainCredentials(self.username, self.password)
+        return self.pika.BlockingConnection(self.pika.ConnectionParameters(host=self.host, port=self.port, credentials=credentials))
+
+    def make_properties(self, expiration=None):
+        return self.pika.BasicProperties(delivery_mode=self.delivery_mode, expiration=self.format_expiration(expiration))
+
+
+class LocalTransport(Transport):
+
+    # Messages are exchanged through the in-process broker of localbroker.py, without any I/O.
+    # The server and the translators must then run in the same process: the translators are
+    # started by the server from the files listed in the Translators key of the [Transport] section.
+    # Nothing is persisted, so the pending translations are lost when the process stops.
+    def __init__(self, config):
+        import localbroker
+        self.localbroker = localbroker
+        self.unroutable_error = localbroker.exceptions.UnroutableError
+        self.channel_closed_error = localbroker.exceptions.ChannelClosedByBroker
+
+    def connect(self):
+        return self.localbroker.BlockingConnection()
+
+    def make_properties(self, expiration=None):
+        if expiration is None:
+            return None
+        return self.localbroker.BasicProperties(expiration=self.format_expiration(expiration))